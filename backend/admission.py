@@ -0,0 +1,278 @@
+import os
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from fastapi.responses import JSONResponse
+
+from metrics import metrics
+import timing
+import tracing
+
+# Routes whose concurrency is limited, as exact paths (after the tenant prefix is stripped;
+# a trailing slash is ignored, so /get-embed-url also covers /get-embed-url/)
+ADMISSION_ROUTES = os.getenv(
+    "ADMISSION_ROUTES",
+    "/ask-agent,/ask-agent/stream,/api/agent-chat,/api/agent-chat/stream,/api/quicksight/predict-qa,"
+    "/api/quicksight/predict-qa/batch,/get-embed-url,/api/quicksight/embed-url,"
+    "/api/quicksight/embed-url-with-identity,/api/quicksight/embed-urls",
+)
+ADMISSION_INITIAL_LIMIT = int(os.getenv("ADMISSION_INITIAL_LIMIT", "16"))
+ADMISSION_MIN_LIMIT = int(os.getenv("ADMISSION_MIN_LIMIT", "2"))
+ADMISSION_MAX_LIMIT = int(os.getenv("ADMISSION_MAX_LIMIT", "128"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))  # waiting requests per route before shedding
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "2"))  # seconds a request may wait for a slot
+# Recent latency above this multiple of the route's long-term latency is a sign of congestion
+ADMISSION_LATENCY_TOLERANCE = float(os.getenv("ADMISSION_LATENCY_TOLERANCE", "1.5"))
+ADMISSION_BACKOFF = float(os.getenv("ADMISSION_BACKOFF", "0.9"))  # limit multiplier on congestion
+
+# Handler responses that mean the upstream is struggling, not the request
+CONGESTION_STATUSES = {429, 502, 503, 504}
+
+# AWS call durations of the request being handled, collected by record_upstream
+_upstream = ContextVar("upstream", default=None)
+
+
+def record_upstream(seconds):
+    """
+    Count an AWS call towards the current request's upstream latency (a
+    no-op outside limited routes). Called by AsyncClient for every call.
+    """
+    calls = _upstream.get()
+    if calls is not None:
+        calls.append(seconds)  # a shared list, so calls made from copies of the context count too
+
+
+class Overloaded(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit for one route that adapts AIMD-style to the upstream
+    latency of its requests: the mean time of their AWS calls, including
+    waits for a rate limit token or an executor thread, so batch requests
+    of any size are comparable (requests served from a cache make no AWS
+    call and leave the averages alone). Recent latency, over
+    the last ten or so requests, is compared with long-term latency, over
+    the last few hundred. While recent stays within tolerance of
+    long-term, every request that completes with the limit in use raises
+    the limit by one; once recent latency degrades, or the upstream
+    throttles, the limit is cut by backoff, at most once per long-term
+    latency. Requests over the
+    limit wait first come first served, and are shed with Overloaded once
+    the queue is full or their wait runs out, so latency stays bounded
+    under overload instead of piling up in the executor.
+    """
+
+    def __init__(self, name, initial=ADMISSION_INITIAL_LIMIT, min_limit=ADMISSION_MIN_LIMIT,
+                 max_limit=ADMISSION_MAX_LIMIT, max_queue=ADMISSION_MAX_QUEUE, max_wait=ADMISSION_MAX_WAIT,
+                 tolerance=ADMISSION_LATENCY_TOLERANCE, backoff=ADMISSION_BACKOFF, window=10, long_window=500):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.window = window
+        self.long_window = long_window
+        self.in_flight = 0
+        self.samples = 0
+        self.recent = None  # moving averages of latency, seconds
+        self.baseline = None
+        self._waiters = deque()
+        self._last_decrease = 0.0
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.decreases = 0
+
+    def _retry_after(self):
+        # Roughly how long the queue ahead takes to drain
+        per_round = self.baseline or 1.0
+        return max(1, math.ceil(per_round * (len(self._waiters) + 1) / self.limit))
+
+    async def acquire(self):
+        """
+        Wait for a slot and return how long that took.
+        """
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return 0.0
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded("queue full", self._retry_after())
+
+        start = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.max_wait)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            self.timed_out += 1
+            raise Overloaded("timed out waiting for a slot", self._retry_after())
+        except asyncio.CancelledError:
+            # Client went away while queued
+            self._abandon(waiter)
+            raise
+        self.admitted += 1
+        return time.monotonic() - start
+
+    def _abandon(self, waiter):
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+        elif waiter.done() and not waiter.cancelled():
+            # Granted a slot just as it gave up; pass the slot on
+            self.in_flight -= 1
+            self._wake()
+
+    def release(self, latency=None, congested=False):
+        """
+        Free a slot and adapt the limit to how the request went: its upstream
+        latency, if it made AWS calls, and whether the upstream pushed back.
+        """
+        self.in_flight -= 1
+        degraded = False
+        if latency is not None:
+            self.samples += 1
+            if self.baseline is None:
+                self.recent = self.baseline = latency
+            # Plain means until the windows have filled, then exponential moving averages
+            self.recent += (latency - self.recent) / min(self.samples, self.window)
+            self.baseline += (latency - self.baseline) / min(self.samples, self.long_window)
+            degraded = self.recent > self.baseline * self.tolerance
+
+        now = time.monotonic()
+        if congested or degraded:
+            if now - self._last_decrease >= (self.baseline or 1.0):
+                # From what is actually in flight: headroom the route never used is no protection
+                self.limit = max(self.min_limit, min(self.limit, self.in_flight + 1) * self.backoff)
+                self._last_decrease = now
+                self.decreases += 1
+        elif self.in_flight + 1 >= self.limit / 2:
+            # Only grow while the limit is actually in use
+            self.limit = min(self.max_limit, self.limit + 1)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def stats(self):
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "recent_ms": round(self.recent * 1000, 1) if self.recent is not None else None,
+            "baseline_ms": round(self.baseline * 1000, 1) if self.baseline is not None else None,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "decreases": self.decreases,
+        }
+
+
+class AdmissionControl:
+    """
+    One adaptive limiter per limited route, for one tenant (so one tenant's
+    slow upstream does not shed another's requests). A path with and without
+    a trailing slash is the same route and shares its limiter.
+    """
+
+    def __init__(self, routes=ADMISSION_ROUTES, **limits):
+        self.limiters = {
+            self._route(path): AdaptiveLimiter(self._route(path), **limits)
+            for path in filter(None, (p.strip() for p in routes.split(",")))
+        }
+
+    @staticmethod
+    def _route(path):
+        return path.rstrip("/") or "/"
+
+    def get(self, path):
+        return self.limiters.get(self._route(path))
+
+    def stats(self):
+        return {path: limiter.stats() for path, limiter in self.limiters.items()}
+
+
+@asynccontextmanager
+async def admitted(limiter, labels):
+    """
+    Hold a slot of limiter for the body of the block, or raise Overloaded
+    if the request is shed. The limiter learns from the AWS calls made
+    inside the block; set outcome["congested"] on the yielded outcome when
+    the upstream pushed back.
+    """
+    try:
+        waited = await limiter.acquire()
+    except Overloaded:
+        metrics.count("admission", labels, "rejected")
+        raise
+    metrics.observe("admission", labels, waited)
+    timing.record("queue", waited, "admission queue")
+    request_span = tracing.current_span()
+    if request_span is not None:
+        request_span.set_attribute("admission.wait_ms", round(waited * 1000, 1))
+
+    outcome = {"congested": False}
+    calls = []
+    token = _upstream.set(calls)
+    try:
+        yield outcome
+    finally:
+        _upstream.reset(token)
+        limiter.release(sum(calls) / len(calls) if calls else None, congested=outcome["congested"])
+
+
+class AdmissionMiddleware:
+    """
+    Admits requests to limited routes through the current tenant's limiter
+    and answers 503 with Retry-After when one sheds them. Sits between
+    TenantMiddleware and MetricsMiddleware: route metrics time requests
+    from admission on, the wait for a slot is recorded separately, and shed
+    requests (which never reach the router) are recorded here.
+    """
+
+    def __init__(self, app, current_tenant):
+        self.app = app
+        self.current_tenant = current_tenant
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            return await self.app(scope, receive, send)
+        limiter = self.current_tenant().admission.get(scope["path"])
+        if limiter is None:
+            return await self.app(scope, receive, send)
+
+        labels = (scope["method"], scope["path"])
+        start = time.perf_counter()
+        try:
+            async with admitted(limiter, labels) as outcome:
+                async def send_with_status(message):
+                    if message["type"] == "http.response.start":
+                        outcome["congested"] = message["status"] in CONGESTION_STATUSES
+                    await send(message)
+
+                await self.app(scope, receive, send_with_status)
+        except Overloaded as e:
+            metrics.observe("http", labels, time.perf_counter() - start, error=True)
+            response = JSONResponse(
+                {"detail": f"Server overloaded ({e}), retry in {e.retry_after}s"},
+                status_code=503,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            return await response(scope, receive, send)
@@ -0,0 +1,494 @@
+import os
+import time
+import asyncio
+import functools
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import botocore.loaders
+import botocore.session
+from botocore.config import Config
+from botocore.eventstream import EventStream
+from botocore.credentials import CredentialProvider, DeferredRefreshableCredentials, RefreshableCredentials
+
+import cassette
+from metrics import instrument_botocore
+from admission import record_upstream
+import timing
+import tracing
+
+# boto3 is blocking, so every upstream call runs on this dedicated, bounded pool
+# instead of the event loop. Size it to the number of concurrent AWS calls one
+# worker should keep in flight.
+AWS_MAX_WORKERS = int(os.getenv("AWS_MAX_WORKERS", "32"))
+
+aws_executor = ThreadPoolExecutor(max_workers=AWS_MAX_WORKERS, thread_name_prefix="aws")
+
+# Connection pool and timeout settings shared by every client the registry builds.
+# The pool should be at least as large as the executor so no worker waits on a socket.
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", str(AWS_MAX_WORKERS)))
+AWS_CONNECT_TIMEOUT = float(os.getenv("AWS_CONNECT_TIMEOUT", "5"))
+AWS_READ_TIMEOUT = float(os.getenv("AWS_READ_TIMEOUT", "60"))
+AWS_TCP_KEEPALIVE = os.getenv("AWS_TCP_KEEPALIVE", "true").lower() == "true"
+AWS_CLIENT_CACHE_SIZE = int(os.getenv("AWS_CLIENT_CACHE_SIZE", "64"))
+
+# Temporary credentials (assumed roles, SSO profiles) are refreshed in the background
+# once they are within AWS_CREDENTIAL_REFRESH_AHEAD seconds of expiry, so requests
+# never wait on STS. Must be larger than the check interval.
+AWS_CREDENTIAL_REFRESH_AHEAD = int(os.getenv("AWS_CREDENTIAL_REFRESH_AHEAD", "900"))
+AWS_CREDENTIAL_CHECK_INTERVAL = int(os.getenv("AWS_CREDENTIAL_CHECK_INTERVAL", "60"))
+AWS_ASSUME_ROLE_DURATION = int(os.getenv("AWS_ASSUME_ROLE_DURATION", "3600"))
+
+# Throttled and transient failures are retried with jittered exponential backoff. In
+# "adaptive" mode each client also slows its own send rate once AWS starts throttling.
+AWS_RETRY_MODE = os.getenv("AWS_RETRY_MODE", "adaptive")  # or standard / legacy
+AWS_MAX_ATTEMPTS = int(os.getenv("AWS_MAX_ATTEMPTS", "5"))
+
+client_config = Config(
+    max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+    connect_timeout=AWS_CONNECT_TIMEOUT,
+    read_timeout=AWS_READ_TIMEOUT,
+    tcp_keepalive=AWS_TCP_KEEPALIVE,
+    retries={'mode': AWS_RETRY_MODE, 'max_attempts': AWS_MAX_ATTEMPTS},
+)
+
+
+# One data loader for every session: service models are parsed once per process
+# instead of once per credential set (or tenant)
+data_loader = botocore.loaders.create_loader()
+
+
+def new_botocore_session():
+    """
+    botocore session that shares the process-wide data loader. Its clients
+    report per-operation latency to /metrics.
+    """
+    session = botocore.session.get_session()
+    session.register_component('data_loader', data_loader)
+    instrument_botocore(session)
+    tracing.instrument_botocore(session)
+    return session
+
+
+def _dedupe_search_paths():
+    # boto3.Session appends its data path to the loader on every construction
+    paths = data_loader.search_paths
+    paths[:] = list(dict.fromkeys(paths))
+
+
+async def run_aws(fn, *args, **kwargs):
+    """
+    Run a blocking boto3 call on the AWS executor and await its result.
+
+    A running call cannot be interrupted, but if the caller is cancelled
+    (client gone, request cancelled) a call that has not started yet never
+    runs, and event streams in the response of one already running are
+    closed as soon as it returns, so the upstream stops producing. The call
+    runs in a copy of the caller's context, so what it records (e.g.
+    credential refreshes, see timing.py) is attributed to the request.
+    """
+    future = aws_executor.submit(contextvars.copy_context().run, functools.partial(fn, *args, **kwargs))
+    try:
+        return await asyncio.wrap_future(future)
+    except asyncio.CancelledError:
+        future.add_done_callback(_close_event_streams)
+        raise
+
+
+def _close_event_streams(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    response = future.result()
+    if isinstance(response, dict):
+        for value in response.values():
+            if isinstance(value, EventStream):
+                value.close()
+
+
+async def iterate_stream(stream):
+    """
+    Iterate a blocking event stream (e.g. invoke_agent's completion) from
+    the event loop, reading each event on the AWS executor. The stream is
+    closed when iteration ends, fails or is abandoned, which ends the
+    upstream response. Traced requests get a span for the whole read.
+    """
+    events = iter(stream)
+    read = None
+    # Not made current: the generator is suspended in its consumer's context between events
+    read_span = tracing.start_span("event stream", attributes={"stream.events": 0, "stream.payload_bytes": 0})
+    try:
+        while True:
+            read = aws_executor.submit(next, events, None)
+            event = await asyncio.wrap_future(read)
+            if event is None:
+                break
+            if read_span is not None:
+                read_span.add("stream.events")
+                read_span.add("stream.payload_bytes", _payload_size(event))
+            yield event
+    except BaseException as e:
+        if read_span is not None and not isinstance(e, GeneratorExit):
+            read_span.set_error(repr(e))
+        raise
+    finally:
+        if read_span is not None:
+            read_span.end()
+        close = getattr(stream, 'close', None)
+        if close is None:
+            pass
+        elif read is None or read.done() or isinstance(stream, EventStream):
+            # An EventStream may be closed under a thread still reading it, which aborts the response at once
+            close()
+        else:
+            # Abandoned mid-read; other iterators (generators) can only be closed once the read returns
+            read.add_done_callback(lambda _: close())
+
+
+def _payload_size(event):
+    # Bytes of text and binary payload in a parsed event
+    if isinstance(event, dict):
+        return sum(_payload_size(value) for value in event.values())
+    if isinstance(event, (bytes, str)):
+        return len(event)
+    return 0
+
+
+def _load_service_models(service_names):
+    for service_name in service_names:
+        for type_name in ('service-2', 'endpoint-rule-set-1'):
+            data_loader.load_service_model(service_name, type_name)
+
+
+async def preload_service_models(service_names):
+    """
+    Parse the service models for service_names on the AWS executor, the bulk
+    of client construction, so clients built afterwards are cheap. Parsing
+    holds the GIL, so it is done in one job rather than one per service.
+    """
+    await run_aws(_load_service_models, service_names)
+
+
+class AsyncClient:
+    """
+    Awaitable view of a boto3 client: `await AsyncClient(client).list_topics(...)`
+    runs `client.list_topics(...)` on the AWS executor so the event loop keeps
+    serving other requests while the upstream call is in flight.
+
+    With factory= instead of a client, the client is only built on first use,
+    on the executor, so neither import time nor the event loop pays for it.
+    With rate_limit=, each call first awaits rate_limit(method_name), so calls
+    queue on the event loop rather than on executor threads. Every call's
+    duration counts towards the request's upstream latency (see admission.py)
+    and is reported, with any rate limit wait, in its Server-Timing header.
+    """
+
+    # Client attributes that are not API operations
+    _attributes = {'meta', 'exceptions'}
+
+    def __init__(self, client=None, factory=None, rate_limit=None):
+        self._client = client
+        self._factory = factory
+        self._rate_limit = rate_limit
+
+    @property
+    def sync(self):
+        if self._client is None:
+            self._client = self._factory()
+        return self._client
+
+    @property
+    def built(self):
+        return self._client is not None
+
+    async def has_operation(self, name):
+        """
+        Whether the client has an operation. boto3 does not generate methods
+        for every API, e.g. Q Business chat, whose input is an event stream.
+        """
+        if self._client is None:
+            await run_aws(lambda: self.sync)
+        return callable(getattr(self._client, name, None))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._client is not None or name in self._attributes:
+            attr = getattr(self.sync, name)
+            if not callable(attr):
+                return attr
+
+        async def call(*args, **kwargs):
+            start = called = time.perf_counter()
+            # Named after the method until botocore names the operation (see tracing.py)
+            with tracing.span(name, tracing.CLIENT) as call_span:
+                try:
+                    if self._rate_limit is not None:
+                        waited = await self._rate_limit(name)
+                        called = time.perf_counter()
+                        if waited is not None:
+                            timing.record("ratelimit", waited, f"rate limit {name}")
+                            if call_span is not None:
+                                call_span.set_attribute("aws.rate_limit_wait_ms", round(waited * 1000, 1))
+                    return await run_aws(lambda: getattr(self.sync, name)(*args, **kwargs))
+                finally:
+                    end = time.perf_counter()
+                    record_upstream(end - start)
+                    timing.record(name, end - called, f"AWS {name}")
+
+        call.__name__ = name
+        return call
+
+
+# botocore has no public setting for when refreshable credentials refresh: it reads the
+# _advisory_refresh_timeout / _mandatory_refresh_timeout attributes of RefreshableCredentials.
+# CredentialCache overrides them, so botocore is pinned in requirements.txt; if a release drops
+# them, refreshes fall back to botocore's own windows (15 and 10 minutes before expiry).
+_REFRESH_WINDOWS = all(
+    hasattr(RefreshableCredentials, attribute)
+    for attribute in ("_advisory_refresh_timeout", "_mandatory_refresh_timeout")
+)
+if not _REFRESH_WINDOWS:
+    print("⚠️ botocore no longer exposes the credential refresh windows; AWS_CREDENTIAL_REFRESH_AHEAD is ignored")
+
+
+def _set_refresh_windows(credentials, advisory, mandatory):
+    if _REFRESH_WINDOWS:
+        credentials._advisory_refresh_timeout = advisory
+        credentials._mandatory_refresh_timeout = mandatory
+
+
+class RefreshAheadCredentials(DeferredRefreshableCredentials):
+    """
+    Credentials fetched by refresh_using on first use and refreshed once
+    within advisory seconds of expiry (callers block only within mandatory).
+    """
+
+    def __init__(self, refresh_using, method, advisory, mandatory):
+        super().__init__(refresh_using=refresh_using, method=method)
+        _set_refresh_windows(self, advisory, mandatory)
+
+
+class CachedCredentialProvider(CredentialProvider):
+    """
+    Puts a session on credentials from the CredentialCache, ahead of the
+    rest of its credential chain.
+    """
+
+    METHOD = "credential-cache"
+
+    def __init__(self, credentials):
+        super().__init__()
+        self.credentials = credentials
+
+    def load(self):
+        return self.credentials
+
+
+class CredentialCache:
+    """
+    Refresh-ahead cache of temporary credentials, keyed by role ARN or profile.
+
+    Entries are botocore RefreshableCredentials, so concurrent requests never
+    stampede STS: inside the advisory window a single caller refreshes while
+    the others keep using the current credentials, and inside the mandatory
+    window callers wait on one shared refresh. A daemon thread touches every
+    entry each AWS_CREDENTIAL_CHECK_INTERVAL seconds so the advisory refresh
+    happens in the background, well before any request would have to block.
+
+    Assumed-role credentials are built here, with their refresh timed into the
+    request's Server-Timing. Profile credentials are botocore's own, with only
+    their refresh windows changed.
+    """
+
+    # Below this many seconds to expiry every caller blocks on the refresh
+    MANDATORY_REFRESH = 60
+
+    @property
+    def mandatory_refresh(self):
+        return min(self.MANDATORY_REFRESH, self.refresh_ahead)
+
+    def __init__(self, refresh_ahead=AWS_CREDENTIAL_REFRESH_AHEAD, check_interval=AWS_CREDENTIAL_CHECK_INTERVAL):
+        self.refresh_ahead = refresh_ahead
+        self.check_interval = check_interval
+        self._credentials = {}
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._stop = threading.Event()
+
+    def assume_role(self, role_arn, role_session_name, sts_client, duration_seconds=AWS_ASSUME_ROLE_DURATION):
+        """
+        Return refreshable credentials for role_arn. The first assume_role call
+        is deferred until the credentials are first used.
+        """
+        def fetch():
+            response = sts_client.assume_role(
+                RoleArn=role_arn,
+                RoleSessionName=role_session_name,
+                DurationSeconds=duration_seconds,
+            )
+            creds = response['Credentials']
+            return {
+                'access_key': creds['AccessKeyId'],
+                'secret_key': creds['SecretAccessKey'],
+                'token': creds['SessionToken'],
+                'expiry_time': creds['Expiration'].isoformat(),
+            }
+
+        def timed_fetch():
+            # Only refreshes on a request's path show up in its Server-Timing, not background ones
+            start = time.perf_counter()
+            try:
+                return fetch()
+            finally:
+                timing.record("credentials", time.perf_counter() - start, "credentials sts-assume-role")
+
+        key = ('role', role_arn)
+        with self._lock:
+            if key not in self._credentials:
+                self._track(key, RefreshAheadCredentials(
+                    timed_fetch, 'sts-assume-role', self.refresh_ahead, self.mandatory_refresh,
+                ))
+            return self._credentials[key]
+
+    def profile(self, profile_name, session):
+        """
+        Resolve a profile's credential chain once and keep it warm.
+        Static credentials are returned as-is; SSO and role profiles are refreshed ahead.
+        """
+        key = ('profile', profile_name)
+        with self._lock:
+            if key not in self._credentials:
+                credentials = session.get_credentials()
+                if not isinstance(credentials, RefreshableCredentials):
+                    return credentials
+                _set_refresh_windows(credentials, self.refresh_ahead, self.mandatory_refresh)
+                self._track(key, credentials)
+            return self._credentials[key]
+
+    def _track(self, key, credentials):
+        self._credentials[key] = credentials
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name="aws-credential-refresh", daemon=True)
+            self._refresher.start()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.check_interval):
+            with self._lock:
+                entries = list(self._credentials.items())
+            for key, credentials in entries:
+                try:
+                    # Triggers the advisory refresh when inside the refresh-ahead window
+                    credentials.get_frozen_credentials()
+                except Exception as e:
+                    print(f"Error refreshing credentials for {key}: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+
+credential_cache = CredentialCache()
+
+
+class ClientRegistry:
+    """
+    Process-wide cache of boto3 sessions and clients.
+
+    Building a client reloads the service model, re-resolves credentials and
+    opens new TLS connections, so each client is created once per
+    (service, region, credential set) and shared by every request. boto3
+    clients are thread-safe; sessions are not, which is why construction
+    happens under a (reentrant) lock. The least recently used entries are dropped once
+    AWS_CLIENT_CACHE_SIZE is reached so rotated credentials don't accumulate.
+
+    With rate_limits (see ratelimit.RateLimits), the async clients apply its
+    per-operation limits before every call.
+    """
+
+    def __init__(self, config=client_config, max_size=AWS_CLIENT_CACHE_SIZE, credentials=credential_cache,
+                 rate_limits=None):
+        self.config = config
+        self.credentials = credentials
+        self.rate_limits = rate_limits
+        self.max_size = max_size
+        self._sessions = OrderedDict()
+        self._clients = OrderedDict()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _key(**kwargs):
+        return tuple(sorted((k, v) for k, v in kwargs.items() if v is not None))
+
+    def _get(self, cache, key, factory):
+        with self._lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+            value = factory()
+            cache[key] = value
+            if len(cache) > self.max_size:
+                cache.popitem(last=False)
+            return value
+
+    def session(self, role_arn=None, role_session_name=None, **session_kwargs):
+        """
+        Return the shared boto3.Session for these credentials
+        (profile_name, or aws_access_key_id / aws_secret_access_key / aws_session_token).
+
+        With role_arn, the session uses cached, refresh-ahead credentials for
+        that role, assumed through an STS client built from session_kwargs.
+        """
+        key = self._key(role_arn=role_arn, role_session_name=role_session_name, **session_kwargs)
+        return self._get(self._sessions, key, lambda: self._build_session(role_arn, role_session_name, **session_kwargs))
+
+    def _build_session(self, role_arn, role_session_name, **session_kwargs):
+        if role_arn:
+            sts_client = self.client('sts', **session_kwargs)
+            botocore_session = new_botocore_session()
+            credentials = self.credentials.assume_role(role_arn, role_session_name or 'QuickSuiteSession', sts_client)
+            botocore_session.get_component('credential_provider').insert_before(
+                'env', CachedCredentialProvider(credentials)
+            )
+            session = boto3.Session(botocore_session=botocore_session)
+            _dedupe_search_paths()
+            return session
+
+        session = boto3.Session(botocore_session=new_botocore_session(), **session_kwargs)
+        _dedupe_search_paths()
+        if session_kwargs.get('profile_name'):
+            self.credentials.profile(session_kwargs['profile_name'], session)
+        return session
+
+    def client(self, service_name, region_name=None, **session_kwargs):
+        """
+        Return the shared client for a service, region and credential set.
+        """
+        key = (service_name, region_name, self._key(**session_kwargs))
+
+        def build():
+            session = self.session(**session_kwargs)
+            return session.client(service_name, region_name=region_name, config=self.config)
+
+        return self._get(self._clients, key, build)
+
+    def async_client(self, service_name, region_name=None, **session_kwargs):
+        """
+        Awaitable view of client() for async handlers. The client itself is
+        built lazily, on the AWS executor, the first time it is used, and is
+        recorded or replaced by a replay client when UPSTREAM_MODE says so.
+        """
+        def build():
+            return self.client(service_name, region_name=region_name, **session_kwargs)
+
+        rate_limit = functools.partial(self.rate_limits.acquire, service_name) if self.rate_limits else None
+        return AsyncClient(factory=cassette.wrap(service_name, build), rate_limit=rate_limit)
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+            self._sessions.clear()
+
+
+clients = ClientRegistry()
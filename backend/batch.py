@@ -0,0 +1,70 @@
+import os
+import asyncio
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+from encoding import dumps
+
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))  # upstream calls in flight per batch
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
+
+def _error(e):
+    if isinstance(e, HTTPException):
+        return {"status": e.status_code, "detail": e.detail}
+    return {"status": 500, "detail": str(e)}
+
+
+async def as_completed(items, fn, concurrency):
+    """
+    Await fn(item) for every item, at most concurrency at a time, yielding
+    (index, result, error) in completion order. A failed item yields its
+    error instead of stopping the others. Closing the generator (e.g. the
+    client disconnected) cancels whatever has not finished.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index, item):
+        async with semaphore:
+            try:
+                return index, await fn(item), None
+            except Exception as e:
+                return index, None, _error(e)
+
+    tasks = [asyncio.ensure_future(run(index, item)) for index, item in enumerate(items)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def ndjson_response(items, fn, concurrency=None):
+    """
+    Stream fn(item) for every item as NDJSON, one line per item as soon as
+    it completes, then a summary line:
+
+        {"index": 3, "ok": true, "result": {...}}
+        {"index": 0, "ok": false, "error": {"status": 403, "detail": ...}}
+        {"done": true, "total": 2, "succeeded": 1, "failed": 1}
+
+    concurrency may lower BATCH_MAX_CONCURRENCY, not raise it.
+    """
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    concurrency = min(concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+
+    async def lines():
+        failed = 0
+        async for index, result, error in as_completed(items, fn, concurrency):
+            if error is None:
+                line = {"index": index, "ok": True, "result": result}
+            else:
+                failed += 1
+                line = {"index": index, "ok": False, "error": error}
+            yield dumps(line) + b"\n"
+        yield dumps({"done": True, "total": len(items), "succeeded": len(items) - failed, "failed": failed}) + b"\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -0,0 +1,56 @@
+"""
+Exercise both session store backends and time get/update.
+
+Runs against a real Redis when SESSION_STORE_URL is set, otherwise against
+fakeredis as a local stand-in. Checks that records merge, survive a second
+store instance (i.e. another worker) and expire.
+
+    pip install fakeredis
+    python benchmarks/bench_session_store.py [OPERATIONS]
+"""
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_store import MemorySessionStore, RedisSessionStore, SESSION_STORE_URL
+
+
+def redis_stores():
+    if SESSION_STORE_URL:
+        return RedisSessionStore(SESSION_STORE_URL, ttl=1), RedisSessionStore(SESSION_STORE_URL, ttl=1)
+    import fakeredis
+    server = fakeredis.FakeServer()
+    return (
+        RedisSessionStore(client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True), ttl=1),
+        RedisSessionStore(client=fakeredis.FakeAsyncRedis(server=server, decode_responses=True), ttl=1),
+    )
+
+
+async def check(name, store, other_worker, operations):
+    await store.update("bench:user", session_id="s-1")
+    await store.update("bench:user", conversation_id="c-1")
+    record = await other_worker.get("bench:user")
+    assert record == {"session_id": "s-1", "conversation_id": "c-1"}, record
+
+    start = time.perf_counter()
+    for i in range(operations):
+        await store.update(f"bench:user-{i}", session_id=str(i))
+        await store.get(f"bench:user-{i}")
+    per_op = (time.perf_counter() - start) / (2 * operations)
+
+    await asyncio.sleep(1.1)
+    assert await store.get("bench:user") is None
+    print(f"{name:<8} ok  {per_op * 1e6:8.1f} us per get/update")
+
+
+async def main(operations):
+    memory = MemorySessionStore(ttl=1)
+    await check("memory", memory, memory, operations)
+    await check("redis", *redis_stores(), operations)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000))
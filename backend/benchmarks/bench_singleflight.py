@@ -0,0 +1,74 @@
+"""
+Check that concurrent identical upstream calls are coalesced into one.
+
+Sends N concurrent identical requests to each coalesced route with the AWS
+clients replaced by slow fakes that count their calls, and checks each
+upstream operation ran exactly once. The predict-qa cache is cleared first so
+the result comes from coalescing alone.
+
+    pip install httpx
+    python benchmarks/bench_singleflight.py [N]
+"""
+import os
+import sys
+import time
+import asyncio
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# A burst of N requests at once would partly be shed by admission control; this checks coalescing only
+os.environ.setdefault("ADMISSION_ROUTES", "")
+
+import httpx
+
+import main
+from aws_clients import AsyncClient
+
+calls = Counter()
+
+
+class SlowFake:
+    def __init__(self, latency=0.2):
+        self.latency = latency
+
+    def predict_qa_results(self, **kwargs):
+        calls["predict_qa_results"] += 1
+        time.sleep(self.latency)
+        return {"PrimaryResult": {}, "AdditionalResults": [], "RequestId": "bench"}
+
+    def list_topics(self, **kwargs):
+        calls["list_topics"] += 1
+        time.sleep(self.latency)
+        return {"TopicsSummaries": []}
+
+    def list_agents(self, **kwargs):
+        calls["list_agents"] += 1
+        time.sleep(self.latency)
+        return {"agentSummaries": []}
+
+
+async def run(n):
+    tenant = main.tenants.default
+    tenant.quicksight = AsyncClient(SlowFake())
+    tenant.bedrock_agent = AsyncClient(SlowFake())
+    tenant.qa_cache.clear()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        requests = {
+            "predict_qa_results": lambda: client.post("/api/quicksight/predict-qa", json={"query_text": "revenue by region"}),
+            "list_topics": lambda: client.get("/api/quicksight/list-topics"),
+            "list_agents": lambda: client.get("/api/list-agent"),
+        }
+        for operation, send in requests.items():
+            responses = await asyncio.gather(*[send() for _ in range(n)])
+            assert all(r.status_code == 200 for r in responses), operation
+            print(f"{n} concurrent requests -> {calls[operation]} {operation} call(s)")
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    asyncio.run(run(n))
+    if any(count != 1 for count in calls.values()):
+        sys.exit("FAIL: identical in-flight calls were not coalesced")
+    print("OK: one upstream call per operation")
@@ -0,0 +1,56 @@
+"""
+Memory cost of an extra tenant in the shared process vs. an extra container.
+
+Starts the app in a fresh interpreter with 1 tenant and with N tenants (each
+with its own static credentials, so each gets its own client pool) and
+compares peak RSS. Before multi-tenant routing every tenant was a separate
+process costing the full single-tenant footprint.
+
+    python benchmarks/bench_tenants.py [N]
+"""
+import os
+import sys
+import json
+import subprocess
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, asyncio, resource
+import main
+from aws_clients import preload_service_models
+from tenants import Tenant
+
+async def build():
+    # Clients are lazy; build them all so each tenant's pool is counted
+    await preload_service_models(Tenant.SERVICES)
+    for tenant in main.tenants:
+        await tenant.build_clients()
+
+asyncio.run(build())
+print(json.dumps({"tenants": len(main.tenants.tenants), "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+
+def measure(n):
+    env = dict(os.environ, TENANTS=",".join(f"t{i}=_T{i}" for i in range(n)))
+    for i in range(n):
+        env[f"AWS_ACCESS_KEY_ID_T{i}"] = f"AKIATENANT{i}"
+        env[f"AWS_SECRET_ACCESS_KEY_T{i}"] = "benchmark"
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=BACKEND, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])["rss_mb"]
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+    single = measure(1)
+    shared = measure(n)
+    per_tenant = (shared - single) / (n - 1)
+    print(f"1 tenant per process:           {single:7.1f} MB")
+    print(f"{n} tenants in one process:      {shared:7.1f} MB")
+    print(f"each added tenant (shared):     {per_tenant:7.1f} MB")
+    print(f"each added tenant (own process): {single:6.1f} MB")
+    print(f"saved per added tenant:         {single - per_tenant:7.1f} MB")
@@ -0,0 +1,49 @@
+"""
+Compare per-request client construction with the shared client registry.
+
+Before the registry, handlers built a fresh boto3 Session and client on every
+request (service model load, credential resolution, new connection pool).
+This times that against a registry lookup. No AWS calls are made.
+
+    python benchmarks/client_registry.py [ITERATIONS]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import boto3
+
+from aws_clients import ClientRegistry
+
+CREDENTIALS = {
+    "aws_access_key_id": "AKIABENCHMARK",
+    "aws_secret_access_key": "benchmark",
+}
+
+
+def per_request(iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        boto3.Session(**CREDENTIALS).client("quicksight", region_name="us-east-1")
+    return (time.perf_counter() - start) / iterations
+
+
+def registry(iterations):
+    registry = ClientRegistry()
+    registry.client("quicksight", region_name="us-east-1", **CREDENTIALS)  # first request pays once
+    start = time.perf_counter()
+    for _ in range(iterations):
+        registry.client("quicksight", region_name="us-east-1", **CREDENTIALS)
+    return (time.perf_counter() - start) / iterations
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    fresh = per_request(iterations)
+    cached = registry(iterations)
+    print(f"new Session + client per request: {fresh * 1000:8.3f} ms")
+    print(f"registry lookup:                  {cached * 1000:8.3f} ms")
+    print(f"speedup:                          {fresh / cached:8.0f}x")
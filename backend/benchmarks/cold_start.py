@@ -0,0 +1,89 @@
+"""
+Cold start: import time and time to first AWS call, with and without warm-up.
+
+Each scenario runs in a fresh interpreter so nothing is cached between them:
+
+  eager    - old behaviour: every client built at import, one after another
+  lazy     - import only; the first requests pay for building the clients
+  warm-up  - import, then the startup warm-up (models parsed once, then
+             every tenant's clients built) before the first request
+
+No network calls are made: warm-up stops before opening connections.
+
+    python benchmarks/cold_start.py [TENANTS]
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, sys, time, asyncio
+start = time.perf_counter()
+import main
+from aws_clients import preload_service_models
+from tenants import Tenant
+imported = time.perf_counter()
+
+async def serial():
+    for tenant in main.tenants:
+        for client in tenant.aws_clients:
+            client.sync
+
+async def warm_up():
+    await preload_service_models(Tenant.SERVICES)
+    for tenant in main.tenants:
+        await tenant.build_clients()
+
+mode = sys.argv[1]
+warm_start = time.perf_counter()
+asyncio.run(warm_up() if mode == "warm-up" else serial())
+built = time.perf_counter()
+
+# First request after startup: every client already built?
+first_start = time.perf_counter()
+for tenant in main.tenants:
+    tenant.quicksight.sync
+first = time.perf_counter()
+
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "build_ms": (built - warm_start) * 1000,
+    "first_call_ms": (first - first_start) * 1000,
+}))
+"""
+
+
+def run(mode, tenants, repeat=5):
+    """
+    Median of each timing over repeat fresh interpreters.
+    """
+    runs = [run_once(mode, tenants) for _ in range(repeat)]
+    return {key: statistics.median(r[key] for r in runs) for key in runs[0]}
+
+
+def run_once(mode, tenants):
+    env = dict(os.environ, TENANTS=",".join(f"t{i}=_T{i}" for i in range(tenants)), AWS_WARMUP="false")
+    for i in range(tenants):
+        env[f"AWS_ACCESS_KEY_ID_T{i}"] = f"AKIATENANT{i}"
+        env[f"AWS_SECRET_ACCESS_KEY_T{i}"] = "benchmark"
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE, mode], cwd=BACKEND, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    tenants = int(sys.argv[1]) if len(sys.argv) > 1 else 2
+
+    eager = run("eager", tenants)
+    warm = run("warm-up", tenants)
+    print(f"{tenants} tenant(s), 5 clients each")
+    # Before lazy clients, the build cost was paid inside the import
+    print(f"eager:   ready to serve after {eager['import_ms'] + eager['build_ms']:7.1f} ms (import + serial build)")
+    print(f"lazy:    ready to serve after {eager['import_ms']:7.1f} ms, first requests pay {eager['build_ms']:7.1f} ms")
+    print(f"warm-up: ready to serve after {warm['import_ms']:7.1f} ms, /ready after {warm['build_ms']:7.1f} ms more, "
+          f"first call {warm['first_call_ms']:5.2f} ms")
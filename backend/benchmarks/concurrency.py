@@ -0,0 +1,69 @@
+"""
+Check that concurrent upstream calls overlap instead of queueing on the event loop.
+
+Fires N concurrent predict-qa requests, each with a distinct question so none
+is served from the cache or coalesced with another, at a QuickSight client
+replaced by a fake that sleeps for LATENCY seconds. With the AWS executor in
+place the batch finishes in roughly one call's latency; if a handler blocked
+the loop it would take N times that. Admission control and rate limits are off
+so they don't queue the calls either.
+
+    pip install httpx
+    python benchmarks/concurrency.py [N] [LATENCY]
+"""
+import os
+import sys
+import time
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("ADMISSION_ROUTES", "")
+os.environ.setdefault("AWS_RATE_LIMITS", "")
+
+import httpx
+
+import main
+from aws_clients import AsyncClient, AWS_MAX_WORKERS
+
+
+class SlowQuickSight:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def predict_qa_results(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return {"PrimaryResult": None, "AdditionalResults": [], "RequestId": "bench"}
+
+
+async def run(n, latency):
+    tenant = main.tenants.default
+    fake = SlowQuickSight(latency)
+    tenant.quicksight = AsyncClient(fake)
+    tenant.qa_cache.clear()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        start = time.perf_counter()
+        responses = await asyncio.gather(
+            *[client.post("/api/quicksight/predict-qa", json={"query_text": f"question {i}"}) for i in range(n)]
+        )
+        elapsed = time.perf_counter() - start
+
+    assert all(r.status_code == 200 for r in responses)
+    assert fake.calls == n, f"{fake.calls} upstream calls for {n} distinct requests"
+    return elapsed
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    n = min(n, AWS_MAX_WORKERS)
+
+    elapsed = asyncio.run(run(n, latency))
+    serial = n * latency
+    print(f"{n} concurrent calls x {latency}s upstream latency: {elapsed:.2f}s (serial would be {serial:.2f}s)")
+
+    if elapsed > 2 * latency:
+        sys.exit(f"FAIL: calls did not overlap ({elapsed:.2f}s > {2 * latency:.2f}s)")
+    print("OK: calls overlapped")
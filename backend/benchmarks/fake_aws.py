@@ -0,0 +1,222 @@
+"""
+Local stand-ins for the AWS services the backend calls, for benchmarks.
+
+Each fake sleeps for its service's latency (with some jitter) and fails a
+configurable fraction of calls with a throttling ClientError, then returns a
+response shaped like the real API's. install() swaps them in for a tenant's
+clients, so the app runs unchanged with no network or credentials.
+"""
+import time
+import uuid
+import datetime
+import functools
+import random
+import threading
+
+from botocore.exceptions import ClientError
+
+# Typical latencies seen from us-east-1, in seconds
+DEFAULT_LATENCY = {
+    "quicksight": 0.3,
+    "sts": 0.05,
+    "bedrock-agent": 0.1,
+    "bedrock-agent-runtime": 1.0,
+    "qbusiness": 1.5,
+}
+
+
+class FakeService:
+    service_name = None
+
+    def __init__(self, latency=None, error_rate=0.0, jitter=0.2, seed=None):
+        self.latency = DEFAULT_LATENCY[self.service_name] if latency is None else latency
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _call(self, operation, response, latency=None):
+        with self._lock:
+            self.calls += 1
+            delay = (self.latency if latency is None else latency) * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+            fail = self._random.random() < self.error_rate
+        time.sleep(delay)
+        if fail:
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"},
+                 "ResponseMetadata": {"HTTPStatusCode": 400}},
+                operation,
+            )
+        return response
+
+
+class FakeQuickSight(FakeService):
+    service_name = "quicksight"
+
+    def list_topics(self, **kwargs):
+        topics = [{"TopicId": f"topic-{i}", "Name": f"Topic {i}", "Arn": f"arn:aws:quicksight:::topic/topic-{i}"}
+                  for i in range(5)]
+        return self._call("ListTopics", {"TopicsSummaries": topics})
+
+    def describe_user(self, UserName, **kwargs):
+        return self._call("DescribeUser", {"User": {"UserName": UserName, "Role": "READER", "Active": True}})
+
+    def _qa_result(self, query_text, i):
+        # Shaped like a real QAResult: the topic, dashboard and visual it drew on, and the generated answer
+        topic = f"topic-{i}"
+        return {
+            "ResultType": "GENERATED_ANSWER",
+            "Topic": {"TopicId": topic, "TopicName": f"Topic {i}",
+                      "TopicArn": f"arn:aws:quicksight:us-east-1:123456789012:topic/{topic}"},
+            "Dashboard": {"DashboardId": f"dashboard-{i}", "DashboardName": f"Dashboard {i}",
+                          "DashboardUrl": f"https://quicksight.example/dashboards/dashboard-{i}"},
+            "Visual": {"VisualId": f"visual-{i}", "VisualTitle": f"Visual {i}",
+                       "VisualUrl": f"https://quicksight.example/dashboards/dashboard-{i}/visuals/visual-{i}"},
+            "GeneratedAnswer": {
+                "QuestionText": query_text,
+                "AnswerStatus": "ANSWER_GENERATED",
+                "TopicId": topic,
+                "TopicName": f"Topic {i}",
+                "Restatement": f"Showing results for {query_text} from Topic {i}, grouped by month. " * 3,
+                "QuestionId": str(uuid.uuid4()),
+                "AnswerId": str(uuid.uuid4()),
+                "QuestionUrl": f"https://quicksight.example/sn/topics/{topic}/questions/{uuid.uuid4()}",
+                "Answer": f"Answer to: {query_text}",
+            },
+        }
+
+    def predict_qa_results(self, QueryText, MaxTopicsToConsider=4, **kwargs):
+        return self._call("PredictQAResults", {
+            "PrimaryResult": self._qa_result(QueryText, 0),
+            "AdditionalResults": [self._qa_result(QueryText, i) for i in range(1, MaxTopicsToConsider)],
+            "RequestId": str(uuid.uuid4()),
+        })
+
+    def generate_embed_url_for_registered_user(self, **kwargs):
+        return self._call("GenerateEmbedUrlForRegisteredUser", {
+            "EmbedUrl": f"https://quicksight.example/embed/{uuid.uuid4()}", "Status": 200,
+        })
+
+    def generate_embed_url_for_registered_user_with_identity(self, **kwargs):
+        return self._call("GenerateEmbedUrlForRegisteredUserWithIdentity", {
+            "EmbedUrl": f"https://quicksight.example/embed/{uuid.uuid4()}", "Status": 200,
+        })
+
+
+class FakeSTS(FakeService):
+    service_name = "sts"
+
+    def get_caller_identity(self, **kwargs):
+        return self._call("GetCallerIdentity", {
+            "Account": "123456789012", "UserId": "AIDAFAKE", "Arn": "arn:aws:iam::123456789012:user/bench",
+        })
+
+
+class FakeBedrockAgent(FakeService):
+    service_name = "bedrock-agent"
+
+    def list_agents(self, **kwargs):
+        agents = [{"agentId": f"agent-{i}", "agentName": f"Agent {i}", "agentStatus": "PREPARED"} for i in range(3)]
+        return self._call("ListAgents", {"agentSummaries": agents})
+
+
+class FakeBedrockAgentRuntime(FakeService):
+    service_name = "bedrock-agent-runtime"
+
+    def __init__(self, latency=None, error_rate=0.0, jitter=0.2, seed=None, chunks=5):
+        super().__init__(latency, error_rate, jitter, seed)
+        self.chunks = chunks
+
+    def invoke_agent(self, inputText, **kwargs):
+        # Half the latency to the response headers, the rest spread over the completion chunks
+        interval = self.latency / 2 / self.chunks
+
+        def completion():
+            for i in range(self.chunks):
+                time.sleep(interval)
+                yield {"chunk": {"bytes": f"part {i} of the answer to {inputText}. ".encode("utf-8")}}
+
+        return self._call("InvokeAgent", {"completion": completion(), "sessionId": kwargs.get("sessionId")},
+                          latency=self.latency / 2)
+
+
+class FakeQBusiness(FakeService):
+    service_name = "qbusiness"
+
+    def __init__(self, latency=None, error_rate=0.0, jitter=0.2, seed=None, attributions=10, chunks=5):
+        super().__init__(latency, error_rate, jitter, seed)
+        self.attributions = attributions
+        self.chunks = chunks
+
+    def _source_attribution(self, i):
+        snippet = f"Excerpt {i} of the document the answer cites, as indexed by Q Business. " * 8
+        return {
+            "title": f"Quarterly report {i}",
+            "snippet": snippet,
+            "url": f"https://docs.example/reports/{i}",
+            "citationNumber": i + 1,
+            "updatedAt": datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc),
+            "textMessageSegments": [
+                {"beginOffset": 0, "endOffset": 40, "snippetExcerpt": {"text": snippet[:200]}},
+            ],
+        }
+
+    def chat_sync(self, userMessage, conversationId=None, **kwargs):
+        return self._call("ChatSync", {
+            "conversationId": conversationId or str(uuid.uuid4()),
+            "systemMessage": f"Answer to: {userMessage}",
+            "systemMessageId": str(uuid.uuid4()),
+            "userMessageId": str(uuid.uuid4()),
+            "sourceAttributions": [self._source_attribution(i) for i in range(self.attributions)],
+        })
+
+    def chat(self, inputStream, conversationId=None, **kwargs):
+        # Like invoke_agent: half the latency to the response headers, the rest spread over
+        # the answer's text deltas, then the metadata event
+        user_message = next(e["textEvent"]["userMessage"] for e in inputStream if "textEvent" in e)
+        interval = self.latency / 2 / self.chunks
+
+        def output_stream():
+            for i in range(self.chunks):
+                time.sleep(interval)
+                yield {"textEvent": {"systemMessage": f"Part {i} of the answer to: {user_message}. "}}
+            yield {"metadataEvent": {
+                "conversationId": conversationId or str(uuid.uuid4()),
+                "systemMessageId": str(uuid.uuid4()),
+                "userMessageId": str(uuid.uuid4()),
+                "sourceAttributions": [self._source_attribution(i) for i in range(self.attributions)],
+            }}
+
+        return self._call("Chat", {"outputStream": output_stream()}, latency=self.latency / 2)
+
+
+FAKES = [FakeQuickSight, FakeSTS, FakeBedrockAgent, FakeBedrockAgentRuntime, FakeQBusiness]
+
+
+def install(tenant, latency=None, error_rate=0.0, seed=None):
+    """
+    Replace every AWS client of tenant with a fake. latency maps service
+    names to seconds (missing ones use DEFAULT_LATENCY). Returns the fakes
+    by service name.
+    """
+    from aws_clients import AsyncClient
+
+    latency = latency or {}
+    fakes = {
+        fake.service_name: fake(latency.get(fake.service_name), error_rate, seed=seed)
+        for fake in FAKES
+    }
+
+    def client(service_name, **kwargs):
+        # Same client-side rate limits as the real clients
+        return AsyncClient(fakes[service_name], rate_limit=functools.partial(tenant.rate_limits.acquire, service_name))
+
+    tenant.quicksight = client("quicksight")
+    tenant.sts = client("sts")
+    tenant.bedrock_agent = client("bedrock-agent")
+    tenant.bedrock = client("bedrock-agent-runtime")
+    tenant.qbusiness = client("qbusiness")
+    # Clients built per call (e.g. with an assumed role) get the fake for their service
+    tenant.client = client
+    return fakes
@@ -0,0 +1,200 @@
+"""
+Load test every route against fake AWS services.
+
+Starts the app in-process with every QuickSight, STS, Bedrock and Q Business
+client replaced by the fakes in fake_aws.py, then drives each route with an
+increasing number of concurrent clients for a fixed time per step. Requests
+per second, p50/p99 latency and error counts are printed and written to a
+JSON file, along with each limited route's admission control state.
+
+Pass --baseline with an earlier result file to compare: the run fails if any
+route/concurrency step lost more than --tolerance of its throughput or its
+p99 grew by more than that.
+
+    pip install httpx
+    python benchmarks/load.py                                     # every route
+    python benchmarks/load.py --routes predict-qa chatsync --concurrency 1 8 32
+    python benchmarks/load.py --latency qbusiness=0.2 --error-rate 0.05
+    python benchmarks/load.py --routes ask-agent --concurrency 8 64 256 --honor-retry-after  # overload
+    python benchmarks/load.py --output after.json --baseline before.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import importlib
+import itertools
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("AWS_WARMUP", "false")
+
+import httpx
+
+import fake_aws
+
+USER_ARN = "arn:aws:quicksight:us-east-1:123456789012:user/default/bench-{}"
+
+# name: (method, path, body for the i-th request or None)
+ROUTES = {
+    "list-topics": ("GET", "/api/quicksight/list-topics", None),
+    "list-agent": ("GET", "/api/list-agent", None),
+    "user-info": ("GET", "/api/quicksight/user-info", None),
+    # Distinct questions: every request misses the cache and calls QuickSight
+    "predict-qa": ("POST", "/api/quicksight/predict-qa", lambda i: {"query_text": f"question {i}"}),
+    "predict-qa-cached": ("POST", "/api/quicksight/predict-qa", lambda i: {"query_text": "same question"}),
+    "predict-qa-batch": ("POST", "/api/quicksight/predict-qa/batch",
+                         lambda i: {"items": [{"query_text": f"question {i}.{j}"} for j in range(20)]}),
+    "get-embed-url": ("GET", "/get-embed-url", None),
+    "embed-url": ("POST", "/api/quicksight/embed-url", lambda i: {"user_arn": USER_ARN.format(i % 100)}),
+    "embed-url-with-identity": ("POST", "/api/quicksight/embed-url-with-identity",
+                                lambda i: {"user_arn": USER_ARN.format(i % 100)}),
+    "ask-agent": ("POST", "/ask-agent", lambda i: {"query": f"question {i}", "user_id": f"user-{i % 100}"}),
+    "ask-agent-stream": ("POST", "/ask-agent/stream", lambda i: {"query": f"question {i}", "user_id": f"user-{i % 100}"}),
+    "agent-chat": ("POST", "/api/agent-chat", lambda i: {"user_message": f"question {i}", "user_id": f"user-{i % 100}"}),
+    "agent-chat-stream": ("POST", "/api/agent-chat/stream",
+                          lambda i: {"user_message": f"question {i}", "user_id": f"user-{i % 100}"}),
+    "chatsync": ("POST", "/chatsync", lambda i: {"user_id": f"user-{i % 100}", "message": f"question {i}"}),
+    "chatsync-stream": ("POST", "/chatsync/stream", lambda i: {"user_id": f"user-{i % 100}", "message": f"question {i}"}),
+}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+async def run_step(client, route, concurrency, duration, honor_retry_after=False):
+    """
+    concurrency clients each sending requests back to back for duration seconds
+    (after waiting out any Retry-After, like a well-behaved client, if asked to).
+    """
+    method, path, body = ROUTES[route]
+    counter = itertools.count()
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            i = next(counter)
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body(i) if body else None)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+                retry_after = response.headers.get("Retry-After")
+                if honor_retry_after and retry_after:
+                    await asyncio.sleep(min(float(retry_after), max(0.0, deadline - time.perf_counter())))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "route": route,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+
+def reset(tenant):
+    # Each step starts cold, so earlier steps' cached results don't flatter later ones
+    tenant.qa_cache.clear()
+    tenant.topic_catalog.data = None
+    tenant.agent_catalog.data = None
+
+
+async def run(args):
+    app_module = importlib.import_module(args.app)
+    # main_ak only configures and re-exports main's app
+    tenant = importlib.import_module("main").tenants.default
+    latency = dict(item.split("=", 1) for item in args.latency)
+    fakes = fake_aws.install(tenant, {k: float(v) for k, v in latency.items()}, args.error_rate, seed=args.seed)
+
+    results = []
+    # An exception escaping a route is a 500 like it would be behind uvicorn, not the end of the run
+    transport = httpx.ASGITransport(app=app_module.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for route in args.routes:
+            for concurrency in args.concurrency:
+                reset(tenant)
+                # The handlers' debug prints would drown the report
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    result = await run_step(client, route, concurrency, args.duration, args.honor_retry_after)
+                limiter = tenant.admission.get(ROUTES[route][1])
+                if limiter is not None:
+                    result["admission"] = limiter.stats()
+                results.append(result)
+                print(f"{route:24} c={concurrency:<4} {result['rps']:8.1f} rps  "
+                      f"p50 {result['p50_ms']:8.1f} ms  p99 {result['p99_ms']:8.1f} ms  "
+                      f"errors {result['errors']}/{result['requests']}")
+
+    return {
+        "app": args.app,
+        "duration": args.duration,
+        "error_rate": args.error_rate,
+        "latency": {name: fake.latency for name, fake in fakes.items()},
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Regressions of report against baseline, as printable strings.
+    """
+    before = {(r["route"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        old = before.get((result["route"], result["concurrency"]))
+        if old is None:
+            continue
+        step = f"{result['route']} c={result['concurrency']}"
+        if result["rps"] < old["rps"] * (1 - tolerance):
+            regressions.append(f"{step}: {old['rps']} -> {result['rps']} rps")
+        if result["p99_ms"] > old["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{step}: p99 {old['p99_ms']} -> {result['p99_ms']} ms")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the backend against fake AWS services.")
+    parser.add_argument("--app", default="main", help="module exposing the app, e.g. main or main_ak")
+    parser.add_argument("--routes", nargs="+", default=list(ROUTES), choices=list(ROUTES))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32, 128])
+    parser.add_argument("--duration", type=float, default=3.0, help="seconds per route and concurrency step")
+    parser.add_argument("--latency", nargs="*", default=[], metavar="SERVICE=SECONDS",
+                        help=f"override fake latencies (defaults: {fake_aws.DEFAULT_LATENCY})")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of AWS calls that are throttled")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--honor-retry-after", action="store_true",
+                        help="clients wait out Retry-After on 429/503 instead of retrying at once")
+    parser.add_argument("--output", default="load-results.json")
+    parser.add_argument("--baseline", help="earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression, as a fraction")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = asyncio.run(run(args))
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit("FAIL: regressions against baseline:\n  " + "\n  ".join(regressions))
+        print(f"OK: no regressions beyond {args.tolerance:.0%} against {args.baseline}")
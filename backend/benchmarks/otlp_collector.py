@@ -0,0 +1,128 @@
+"""
+Local stand-in for an OpenTelemetry collector, for looking at traces.
+
+Accepts OTLP/HTTP JSON export requests on /v1/traces, appends them to a file
+(one request per line, the format TRACING_EXPORTER=file writes) and prints
+each trace, once its request span arrives, as a tree of spans with their
+durations and attributes.
+
+    python benchmarks/otlp_collector.py                       # listen on :4318
+    TRACING_EXPORTER=otlp TRACING_SAMPLE_RATE=1 uvicorn main:app --port 8004
+    python benchmarks/otlp_collector.py --summary traces.jsonl  # print a file's traces
+"""
+import sys
+import json
+import argparse
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def spans_of(export_request):
+    for resource_spans in export_request.get("resourceSpans", []):
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            yield from scope_spans.get("spans", [])
+
+
+def _value(value):
+    return next(iter(value.values()), None)
+
+
+def format_trace(spans):
+    """
+    A trace's spans as an indented tree, children under their parents in
+    start order. Spans whose parent is not in spans (e.g. a caller's) are
+    roots.
+    """
+    ids = {span["spanId"] for span in spans}
+    children = defaultdict(list)
+    for span in sorted(spans, key=lambda s: int(s["startTimeUnixNano"])):
+        parent = span.get("parentSpanId")
+        children[parent if parent in ids else None].append(span)
+
+    lines = []
+
+    def walk(span, depth):
+        duration = (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+        attributes = " ".join(f"{a['key']}={_value(a['value'])}" for a in span.get("attributes", []))
+        error = f"  ERROR {span['status'].get('message')}" if span.get("status", {}).get("code") == 2 else ""
+        lines.append(f"{'  ' * depth}{span['name']:<{48 - 2 * depth}} {duration:9.1f} ms  {attributes}{error}")
+        for child in children[span["spanId"]]:
+            walk(child, depth + 1)
+
+    for root in children[None]:
+        walk(root, 0)
+    return "\n".join(lines)
+
+
+def print_traces(spans):
+    traces = defaultdict(list)
+    for span in spans:
+        traces[span["traceId"]].append(span)
+    for trace_id, trace_spans in traces.items():
+        print(f"trace {trace_id}")
+        print(format_trace(trace_spans))
+        print()
+
+
+def serve(port, output, quiet=False):
+    lock = threading.Lock()
+    pending = defaultdict(list)  # trace id -> spans received so far
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/v1/traces":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                export_request = json.loads(body)
+            except ValueError:
+                self.send_response(400)
+                self.end_headers()
+                return
+            with lock:
+                with open(output, "ab") as f:
+                    f.write(body.rstrip(b"\n") + b"\n")
+                if not quiet:
+                    # Children end, and so are exported, before their request's span: print a
+                    # trace once its server span has arrived
+                    done = []
+                    for span in spans_of(export_request):
+                        pending[span["traceId"]].append(span)
+                        if span.get("kind") == 2:
+                            done.append(span["traceId"])
+                    print_traces([span for trace_id in done for span in pending.pop(trace_id, [])])
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    print(f"Collecting OTLP/HTTP JSON traces on http://127.0.0.1:{port}/v1/traces into {output}")
+    return server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Receive and print OTLP/HTTP JSON traces.")
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--output", default="collected-traces.jsonl")
+    parser.add_argument("--quiet", action="store_true", help="store traces without printing them")
+    parser.add_argument("--summary", metavar="FILE", help="print the traces in FILE instead of listening")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.summary:
+        with open(args.summary) as f:
+            print_traces([span for line in f if line.strip() for span in spans_of(json.loads(line))])
+        sys.exit(0)
+    try:
+        serve(args.port, args.output, args.quiet).serve_forever()
+    except KeyboardInterrupt:
+        pass
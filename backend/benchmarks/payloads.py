@@ -0,0 +1,121 @@
+"""
+Bytes on the wire and JSON serialization time for the large-payload routes.
+
+Serialization: times FastAPI's path for a plain dict return (jsonable_encoder,
+then json.dumps) against encoding.dumps, on predict-qa and chat responses
+shaped like the real APIs', and checks both produce the same JSON.
+
+Wire: calls each route in-process against the fakes in fake_aws.py, with
+and without compression and a fields= projection, and prints the bytes
+received for each.
+
+    pip install httpx
+    python benchmarks/payloads.py
+    python benchmarks/payloads.py --attributions 50 --topics 10
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("AWS_WARMUP", "false")
+os.environ.setdefault("ADMISSION_ROUTES", "")
+
+import httpx
+from fastapi.encoders import jsonable_encoder
+
+import fake_aws
+import compression
+from encoding import dumps, orjson
+
+# name: (path, body, fields= for the callers that only show the answer and its links)
+ROUTES = {
+    "predict-qa": ("/api/quicksight/predict-qa", {"query_text": "sales by region"},
+                   "primary_result.GeneratedAnswer.Answer,primary_result.Dashboard.DashboardUrl,request_id"),
+    "agent-chat": ("/api/agent-chat", {"user_message": "sales by region", "user_id": "bench"},
+                   "system_message,conversation_id,parent_message_id,source_attributions.title,source_attributions.url"),
+    "chatsync": ("/chatsync", {"user_id": "bench", "message": "sales by region"},
+                 "systemMessage,conversationId,sourceAttributions.title,sourceAttributions.url"),
+}
+
+
+def fastapi_dumps(value):
+    # What a route returning a plain dict cost before: FastAPI's jsonable_encoder, then JSONResponse.render
+    return json.dumps(jsonable_encoder(value), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def per_call(fn, value, number):
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn(value)
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def serialization(fakes, topics, number):
+    payloads = {
+        "predict-qa": fakes["quicksight"].predict_qa_results(QueryText="sales by region", MaxTopicsToConsider=topics),
+        "agent-chat": fakes["qbusiness"].chat_sync(userMessage="sales by region"),
+    }
+    print(f"encoder: {'orjson' if orjson is not None else 'pydantic-core'}")
+    for name, payload in payloads.items():
+        before, after = fastapi_dumps(payload), dumps(payload)
+        assert json.loads(before) == json.loads(after), name
+        t_before, t_after = per_call(fastapi_dumps, payload, number), per_call(dumps, payload, number)
+        print(f"{name:<12} {len(after):>8} B  before {t_before * 1e6:8.1f} us  "
+              f"after {t_after * 1e6:8.1f} us  ({t_before / t_after:.1f}x)")
+
+
+async def wire(app, topics):
+    encodings = ["identity", "gzip"] + (["br"] if compression.brotli is not None else [])
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for name, (path, body, fields) in ROUTES.items():
+            if name == "predict-qa":
+                body = {**body, "max_topics": topics}
+            sizes = {}
+            for projected in (False, True):
+                keys = set()
+                for encoding in encodings:
+                    response = await client.post(path, json=body, params={"fields": fields} if projected else None,
+                                                 headers={"Accept-Encoding": encoding})
+                    assert response.status_code == 200, response.text
+                    # Bodies under COMPRESSION_MIN_SIZE are sent as they are
+                    if len(response.content) >= compression.COMPRESSION_MIN_SIZE:
+                        assert response.headers.get("content-encoding", "identity") == encoding, response.headers
+                    sizes[(projected, encoding)] = response.num_bytes_downloaded
+                    keys.add(tuple(json.loads(response.content)))  # decoded by httpx
+                assert len(keys) == 1, (name, keys)
+            line = "  ".join(
+                f"{'fields ' if projected else ''}{encoding} {size:>7} B" for (projected, encoding), size in sizes.items()
+            )
+            before = sizes[(False, "identity")]
+            after = min(sizes.values())
+            print(f"{name:<12} {line}  ({before / after:.1f}x smaller)")
+
+
+async def main(args):
+    import main as app_module
+
+    # No latency: only serialization and compression are being measured
+    fakes = fake_aws.install(app_module.tenants.default, {name: 0.0 for name in fake_aws.DEFAULT_LATENCY})
+    fakes["qbusiness"].attributions = args.attributions
+    serialization(fakes, args.topics, args.number)
+    print()
+    await wire(app_module.app, args.topics)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure response sizes and JSON serialization time.")
+    parser.add_argument("--attributions", type=int, default=10, help="source attributions per chat answer")
+    parser.add_argument("--topics", type=int, default=4, help="topics per predict-qa answer")
+    parser.add_argument("--number", type=int, default=200, help="serializations per timing run")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
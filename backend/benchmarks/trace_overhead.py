@@ -0,0 +1,91 @@
+"""
+Cost of tracing per request, at several sampling rates.
+
+Serves predict-qa in-process against the fakes in fake_aws.py with no
+upstream latency, so what remains is the app's own overhead, first with
+tracing off and then exporting to a file at each sampling rate. Prints the
+mean time per request and the spans exported, and checks the shape of one
+trace: the request span with a child span per AWS call.
+
+    pip install httpx
+    python benchmarks/trace_overhead.py [REQUESTS_PER_ROUND]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("AWS_WARMUP", "false")
+os.environ.setdefault("ADMISSION_ROUTES", "")
+os.environ.setdefault("AWS_RATE_LIMITS", "")  # measure the app, not the rate limit
+
+import httpx
+
+import fake_aws
+import tracing
+from otlp_collector import spans_of, format_trace
+
+SAMPLE_RATES = [0.0, 0.01, 0.1, 1.0]
+
+
+async def mean_latency(client, tenant, requests, rounds=5):
+    # Best of a few rounds: scheduling noise is larger than what is measured
+    best = float("inf")
+    for _ in range(rounds):
+        tenant.qa_cache.clear()
+        start = time.perf_counter()
+        for i in range(requests):
+            response = await client.post("/api/quicksight/predict-qa", json={"query_text": f"question {i}"})
+            assert response.status_code == 200, response.text
+        best = min(best, (time.perf_counter() - start) / requests)
+    return best
+
+
+async def main(requests):
+    import main as app_module
+
+    tenant = app_module.tenants.default
+    fake_aws.install(tenant, {name: 0.0 for name in fake_aws.DEFAULT_LATENCY})
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        # The handlers' debug prints would drown the report
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            await mean_latency(client, tenant, 50, rounds=1)  # warm up
+            off = await mean_latency(client, tenant, requests)
+        print(f"tracing off     {off * 1e6:8.1f} us per request")
+
+        with tempfile.TemporaryDirectory() as directory:
+            for rate in SAMPLE_RATES:
+                path = os.path.join(directory, f"traces-{rate}.jsonl")
+                tracing.tracer.exporter = tracing.SpanExporter(tracing.file_writer(path))
+                tracing.tracer.sample_rate = rate
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    latency = await mean_latency(client, tenant, requests)
+                tracing.tracer.shutdown()
+
+                spans = []
+                if os.path.exists(path):
+                    with open(path) as f:
+                        spans = [span for line in f for span in spans_of(json.loads(line))]
+                print(f"sampled {rate:<6}  {latency * 1e6:8.1f} us per request  "
+                      f"(+{(latency - off) * 1e6:6.1f} us)  {len(spans)} spans")
+
+                if rate == 1.0:
+                    roots = [s for s in spans if "parentSpanId" not in s]
+                    assert len(roots) == 5 * requests, len(roots)
+                    trace = [s for s in spans if s["traceId"] == roots[0]["traceId"]]
+                    assert [s["name"] for s in trace if s is not roots[0]] == ["predict_qa_results"], trace
+                    assert all(s["parentSpanId"] == roots[0]["spanId"] for s in trace if s is not roots[0])
+                    print()
+                    print(format_trace(trace))
+
+    tracing.tracer.exporter = None
+    print("\nOK: one span per request and per AWS call")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,102 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+QA_CACHE_TTL = int(os.getenv("QA_CACHE_TTL", "300"))  # seconds
+QA_CACHE_MAX_ENTRIES = int(os.getenv("QA_CACHE_MAX_ENTRIES", "1000"))
+QA_CACHE_MAX_BYTES = int(os.getenv("QA_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def normalize_query(text):
+    """
+    Case- and whitespace-insensitive form of a question, used in cache keys.
+    """
+    return " ".join(text.lower().split())
+
+
+class TTLCache:
+    """
+    Bounded LRU cache with a per-entry TTL.
+
+    Capped both by entry count and by approximate memory, measured as the
+    JSON-encoded size of each value at insert time. When either cap is hit
+    the least recently used entries are evicted first.
+
+    generation changes on every clear(). A caller filling the cache from a
+    slow upstream call reads it first and passes it to set(), so a value
+    fetched before a clear is not stored after it.
+    """
+
+    def __init__(self, ttl=QA_CACHE_TTL, max_entries=QA_CACHE_MAX_ENTRIES, max_bytes=QA_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Return the cached value, or None if missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, generation=None):
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return  # cleared while the value was being fetched
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Drop every entry and return how many were removed.
+        """
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            self.generation += 1
+            return count
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
@@ -0,0 +1,245 @@
+import os
+import json
+import gzip
+import time
+import base64
+import hashlib
+import datetime
+import threading
+import itertools
+from collections import defaultdict
+
+from botocore.eventstream import EventStream
+from botocore.exceptions import ClientError
+
+# live: call AWS. record: call AWS and append every exchange to the cassette.
+# replay: serve exchanges from the cassette with no network or credentials.
+UPSTREAM_MODE = os.getenv("UPSTREAM_MODE", "live")
+UPSTREAM_CASSETTE = os.getenv("UPSTREAM_CASSETTE", "upstream.jsonl.gz")
+# Replay pace: 1 = as recorded, 4 = four times faster, 0 = no delays at all
+UPSTREAM_REPLAY_SPEED = float(os.getenv("UPSTREAM_REPLAY_SPEED", "1"))
+
+
+class NotRecorded(LookupError):
+    pass
+
+
+def _encode(value):
+    if isinstance(value, (bytes, bytearray)):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _decode(obj):
+    if "__bytes__" in obj and len(obj) == 1:
+        return base64.b64decode(obj["__bytes__"])
+    return obj
+
+
+def params_key(params):
+    """
+    Short, stable digest of a call's parameters.
+    """
+    body = json.dumps(params, sort_keys=True, default=_encode)
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()[:16]
+
+
+class Cassette:
+    """
+    Upstream exchanges on disk, one JSON line per call (gzip-compressed when
+    the path ends in .gz). A line holds the service, operation, a digest of
+    the parameters, the latency and the response or error. Event streams are
+    stored as their events, each with its offset from the start of the call.
+    """
+
+    def __init__(self, path=UPSTREAM_CASSETTE, speed=UPSTREAM_REPLAY_SPEED):
+        self.path = path
+        self.speed = speed
+        self._file = None
+        self._lock = threading.Lock()
+        self._exact = defaultdict(list)  # (service, operation, key) -> entries
+        self._by_operation = defaultdict(list)  # (service, operation) -> entries
+        self._cursors = {}
+
+    def _open(self, mode):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    # --- record ---
+
+    def write(self, entry):
+        line = json.dumps(entry, separators=(",", ":"), default=_encode) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = self._open("a")
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # --- replay ---
+
+    def load(self):
+        with self._open("r") as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line, object_hook=_decode)
+                        self._exact[(entry["service"], entry["operation"], entry["key"])].append(entry)
+                        self._by_operation[(entry["service"], entry["operation"])].append(entry)
+            except (EOFError, json.JSONDecodeError):
+                # Recording process was killed mid-write; keep what is complete
+                pass
+        print(f"📼 Replaying {sum(map(len, self._by_operation.values()))} upstream calls from {self.path}")
+        return self
+
+    def find(self, service, operation, params):
+        """
+        The recording of this exact call, else any recording of the same
+        operation. Repeated calls cycle through the matching recordings.
+        """
+        for index, key in (
+            (self._exact, (service, operation, params_key(params))),
+            (self._by_operation, (service, operation)),
+        ):
+            entries = index.get(key)
+            if entries:
+                with self._lock:
+                    cursor = self._cursors.setdefault(key, itertools.cycle(entries))
+                    return next(cursor)
+        raise NotRecorded(f"No {service}.{operation} call recorded in {self.path}")
+
+    def recorded(self, service, operation):
+        return bool(self._by_operation.get((service, operation)))
+
+    def sleep(self, seconds):
+        if self.speed > 0 and seconds > 0:
+            time.sleep(seconds / self.speed)
+
+
+class RecordingClient:
+    """
+    Wraps a boto3 client and writes every call it makes to the cassette.
+    An event stream is written once it has been consumed.
+    """
+
+    def __init__(self, client, service_name, cassette):
+        self._client = client
+        self._service_name = service_name
+        self._cassette = cassette
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name in ("meta", "exceptions"):
+            return attr
+
+        def call(**params):
+            entry = {"service": self._service_name, "operation": name, "key": params_key(params)}
+            start = time.perf_counter()
+            try:
+                response = attr(**params)
+            except ClientError as e:
+                entry.update(latency=time.perf_counter() - start, error=e.response)
+                self._cassette.write(entry)
+                raise
+            entry["latency"] = time.perf_counter() - start
+            response = _strip_headers(response)
+
+            streams = {k: v for k, v in response.items() if isinstance(v, EventStream)}
+            if not streams:
+                self._cassette.write(dict(entry, response=response))
+                return response
+            # Record the rest of the response now and each stream as the caller reads it
+            entry["response"] = {k: v for k, v in response.items() if k not in streams}
+            entry["streams"] = {}
+            pending = set(streams)
+            for field, stream in streams.items():
+                response[field] = self._record_stream(entry, field, stream, start, pending)
+            return response
+
+        call.__name__ = name
+        return call
+
+    def _record_stream(self, entry, field, stream, start, pending):
+        events = entry["streams"][field] = []
+        try:
+            for event in stream:
+                events.append([time.perf_counter() - start, event])
+                yield event
+        finally:
+            pending.discard(field)
+            if not pending:
+                self._cassette.write(entry)
+
+
+class ReplayClient:
+    """
+    Serves a service's calls from the cassette at the recorded (or scaled)
+    pace. Event streams are replayed event by event. Only recorded
+    operations exist, so has_operation checks see what the recorded
+    client had.
+    """
+
+    def __init__(self, service_name, cassette):
+        self._service_name = service_name
+        self._cassette = cassette
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if not self._cassette.recorded(self._service_name, name):
+            raise AttributeError(f"No {self._service_name}.{name} call recorded in {self._cassette.path}")
+
+        def call(**params):
+            entry = self._cassette.find(self._service_name, name, params)
+            self._cassette.sleep(entry["latency"])
+            if "error" in entry:
+                raise ClientError(entry["error"], name)
+            response = dict(entry["response"])
+            for field, events in entry.get("streams", {}).items():
+                response[field] = self._replay_stream(events, entry["latency"])
+            return response
+
+        call.__name__ = name
+        return call
+
+    def _replay_stream(self, events, elapsed):
+        for offset, event in events:
+            self._cassette.sleep(offset - elapsed)
+            elapsed = max(elapsed, offset)
+            yield event
+
+
+def _strip_headers(response):
+    # Raw HTTP headers are bulky and never read by the handlers
+    metadata = response.get("ResponseMetadata")
+    if metadata:
+        response = dict(response, ResponseMetadata={k: v for k, v in metadata.items() if k != "HTTPHeaders"})
+    return response
+
+
+cassette = None
+if UPSTREAM_MODE == "record":
+    cassette = Cassette()
+    print(f"📼 Recording upstream calls to {UPSTREAM_CASSETTE}")
+elif UPSTREAM_MODE == "replay":
+    cassette = Cassette().load()
+
+
+def wrap(service_name, build):
+    """
+    Client factory for the configured mode: build() as is when live, wrapped
+    for recording, or a replay client that never calls build() at all.
+    """
+    if UPSTREAM_MODE == "record":
+        return lambda: RecordingClient(build(), service_name, cassette)
+    if UPSTREAM_MODE == "replay":
+        return lambda: ReplayClient(service_name, cassette)
+    return build
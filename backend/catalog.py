@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import asyncio
+import contextvars
+import hashlib
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+
+import timing
+import tracing
+from singleflight import SingleFlight
+
+CATALOG_REFRESH_INTERVAL = int(os.getenv("CATALOG_REFRESH_INTERVAL", "3600"))  # seconds between upstream reloads
+CATALOG_CLIENT_MAX_AGE = int(os.getenv("CATALOG_CLIENT_MAX_AGE", "300"))  # how long clients may reuse a response
+
+
+class Catalog:
+    """
+    In-memory snapshot of slowly changing upstream metadata (topics, agents).
+
+    The first request loads it; after that a background task reloads it every
+    CATALOG_REFRESH_INTERVAL seconds and requests are served from memory. A
+    failed background reload keeps serving the previous snapshot. Responses
+    carry an ETag derived from the content, so clients can revalidate with
+    If-None-Match and get a 304 when nothing changed.
+    """
+
+    def __init__(self, name, load, refresh_interval=CATALOG_REFRESH_INTERVAL, max_age=CATALOG_CLIENT_MAX_AGE):
+        self.name = name
+        self._load = load
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.data = None
+        self.etag = None
+        self.refreshed_at = None
+        self._flight = SingleFlight()
+        self._scheduler = None
+
+    async def get(self):
+        if self.data is None:
+            # The load runs detached (see SingleFlight): time the wait for this request
+            with timing.phase("catalog", f"loading the {self.name} catalog"), \
+                    tracing.span("catalog load", attributes={"catalog": self.name}):
+                await self.refresh()
+        self._ensure_scheduler()
+        return self.data
+
+    async def refresh(self):
+        """
+        Reload from upstream now. Concurrent refreshes share one upstream load.
+        """
+        data = jsonable_encoder(await self._flight.do(self.name, self._load))
+        body = json.dumps(data, sort_keys=True).encode("utf-8")
+        self.data = data
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.refreshed_at = time.time()
+        return self.data
+
+    def response(self, request, content):
+        """
+        JSON response for content built from the snapshot, or 304 if the client's copy is current.
+        """
+        headers = {
+            "ETag": self.etag,
+            "Cache-Control": f"private, max-age={self.max_age}, must-revalidate",
+        }
+        if_none_match = request.headers.get("if-none-match", "")
+        if self.etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        return JSONResponse(content=content, headers=headers)
+
+    def info(self):
+        return {
+            "etag": self.etag,
+            "refreshed_at": self.refreshed_at,
+            "refresh_interval": self.refresh_interval,
+        }
+
+    def _ensure_scheduler(self):
+        if self._scheduler is None or self._scheduler.done():
+            # A fresh context: refreshes belong to no request's trace or Server-Timing
+            self._scheduler = asyncio.create_task(self._refresh_loop(), context=contextvars.Context())
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Error refreshing {self.name} catalog: {e}")
@@ -0,0 +1,101 @@
+import os
+import gzip
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # optional; without it responses are gzipped
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))  # bytes; smaller bodies gain too little
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))  # 11 is far too slow per request
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/javascript", "text/")
+
+
+def accept_encoding_weights(accept_encoding):
+    """
+    Quality of each content coding named in an Accept-Encoding header.
+    """
+    weights = {}
+    for entry in accept_encoding.split(","):
+        coding, *params = (part.strip() for part in entry.split(";"))
+        q = next((p[2:] for p in params if p.startswith("q=")), "1")
+        try:
+            weights[coding.lower()] = float(q)
+        except ValueError:
+            pass
+    return weights
+
+
+def choose_encoding(accept_encoding):
+    """
+    brotli if available and accepted, else gzip if accepted, else None. A
+    coding named with q=0 is refused even if "*" would accept it.
+    """
+    weights = accept_encoding_weights(accept_encoding)
+    any_coding = weights.get("*", 0)
+    if brotli is not None and weights.get("br", any_coding) > 0:
+        return "br"
+    if weights.get("gzip", any_coding) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    Compresses complete JSON and text responses with brotli (when installed)
+    or gzip, whichever the client accepts. Streamed responses (SSE, NDJSON)
+    pass through untouched: compressing them would hold events back until
+    the compressor filled a block.
+    """
+
+    def __init__(self, app, minimum_size=COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message  # held until we know whether the body is complete
+                return
+            if start is None:
+                return await send(message)
+
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            eligible = (
+                not message.get("more_body", False)
+                and len(body) >= self.minimum_size
+                and "content-encoding" not in headers
+                and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+            )
+            if eligible:
+                headers.add_vary_header("Accept-Encoding")
+                if encoding is not None:
+                    body = compress(body, encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                    message = {**message, "body": body}
+            await send(start)
+            start = None
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,163 @@
+import os
+import time
+import asyncio
+import contextvars
+from collections import OrderedDict, deque
+
+# Embed URLs are single-use and must be redeemed within 5 minutes of generation,
+# so they can't be cached - but a few fresh, unconsumed ones can be kept ready.
+EMBED_URL_POOL_SIZE = int(os.getenv("EMBED_URL_POOL_SIZE", "2"))
+EMBED_URL_MAX_AGE = int(os.getenv("EMBED_URL_MAX_AGE", "240"))  # evict well before the 300s redemption window closes
+EMBED_URL_POOL_IDLE_TTL = int(os.getenv("EMBED_URL_POOL_IDLE_TTL", "1800"))  # forget users not seen for this long
+EMBED_URL_POOL_MAX_USERS = int(os.getenv("EMBED_URL_POOL_MAX_USERS", "1000"))
+
+
+class _UserPool:
+    __slots__ = ("generate", "urls", "last_used", "refill_task")
+
+    def __init__(self, generate):
+        self.generate = generate
+        self.urls = deque()  # (generated_at, response)
+        self.last_used = time.monotonic()
+        self.refill_task = None
+
+
+class EmbedUrlPool:
+    """
+    Per-user pool of pre-generated, unconsumed QuickSight embed URLs.
+
+    get() hands out a pooled URL when one is available (a hit) and otherwise
+    generates one inline (a miss). Refills only happen on demand: after a hit
+    the pool is topped back up to size in the background, after a miss one
+    URL is kept ready, so a user seen once costs two calls, not size + 1.
+    URLs older than EMBED_URL_MAX_AGE are evicted so nothing handed out is
+    close to its redemption deadline; they are not replaced until the user
+    comes back. Users idle for longer than EMBED_URL_POOL_IDLE_TTL are
+    forgotten.
+
+    Refills share the operation's rate limit with user requests, so with
+    busy (a callable, true while user requests are queued for a token) they
+    are skipped instead of taking tokens from those requests.
+    """
+
+    def __init__(
+        self,
+        size=EMBED_URL_POOL_SIZE,
+        max_age=EMBED_URL_MAX_AGE,
+        idle_ttl=EMBED_URL_POOL_IDLE_TTL,
+        max_users=EMBED_URL_POOL_MAX_USERS,
+        busy=None,
+    ):
+        self.size = size
+        self.max_age = max_age
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self.busy = busy
+        self._pools = OrderedDict()
+        self._sweeper = None
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.refill_errors = 0
+        self.refills_skipped = 0
+        self._refill_ms = deque(maxlen=200)
+
+    async def get(self, key, generate):
+        """
+        Return an embed URL response for key (e.g. the user ARN plus request options).
+        generate is an async callable producing a fresh
+        generate_embed_url_* response for that key.
+        """
+        pool = self._pool(key, generate)
+        pool.last_used = time.monotonic()
+        self._evict_stale(pool)
+        self._ensure_sweeper()
+
+        if pool.urls:
+            self.hits += 1
+            _, response = pool.urls.popleft()
+            self._schedule_refill(pool, self.size)
+            return response
+
+        self.misses += 1
+        response = await generate()
+        self._schedule_refill(pool, min(1, self.size))
+        return response
+
+    def stats(self):
+        latencies = sorted(self._refill_ms)
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 3) if requests else None,
+            "expired": self.expired,
+            "refill_errors": self.refill_errors,
+            "refills_skipped": self.refills_skipped,
+            "users": len(self._pools),
+            "pooled_urls": sum(len(p.urls) for p in self._pools.values()),
+            "refill_latency_ms": {
+                "count": len(latencies),
+                "avg": round(sum(latencies) / len(latencies), 2) if latencies else None,
+                "p50": latencies[len(latencies) // 2] if latencies else None,
+                "max": latencies[-1] if latencies else None,
+            },
+        }
+
+    def _pool(self, key, generate):
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = _UserPool(generate)
+            if len(self._pools) > self.max_users:
+                _, oldest = self._pools.popitem(last=False)
+                if oldest.refill_task:
+                    oldest.refill_task.cancel()
+        else:
+            pool.generate = generate
+            self._pools.move_to_end(key)
+        return pool
+
+    def _evict_stale(self, pool):
+        cutoff = time.monotonic() - self.max_age
+        while pool.urls and pool.urls[0][0] < cutoff:
+            pool.urls.popleft()
+            self.expired += 1
+
+    def _schedule_refill(self, pool, target):
+        if len(pool.urls) < target and (pool.refill_task is None or pool.refill_task.done()):
+            # A fresh context: the refill outlives the request that triggered it
+            pool.refill_task = asyncio.create_task(self._refill(pool, target), context=contextvars.Context())
+
+    async def _refill(self, pool, target):
+        while len(pool.urls) < target:
+            if self.busy is not None and self.busy():
+                self.refills_skipped += 1
+                return
+            start = time.perf_counter()
+            try:
+                response = await pool.generate()
+            except Exception as e:
+                self.refill_errors += 1
+                print(f"Error refilling embed URL pool: {e}")
+                return
+            self._refill_ms.append(round((time.perf_counter() - start) * 1000, 2))
+            pool.urls.append((time.monotonic(), response))
+
+    def _ensure_sweeper(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep(), context=contextvars.Context())
+
+    async def _sweep(self):
+        # Drop URLs that age out and forget idle users. Nothing is generated
+        # here: URLs for users who may not come back would be wasted calls
+        while self._pools:
+            await asyncio.sleep(max(1, self.max_age // 4))
+            now = time.monotonic()
+            for key, pool in list(self._pools.items()):
+                if now - pool.last_used > self.idle_ttl:
+                    if pool.refill_task:
+                        pool.refill_task.cancel()
+                    del self._pools[key]
+                    continue
+                self._evict_stale(pool)
@@ -0,0 +1,147 @@
+import os
+import json
+import asyncio
+from contextlib import nullcontext
+
+from fastapi import HTTPException, WebSocketDisconnect
+from pydantic import ValidationError
+
+from admission import admitted, Overloaded, CONGESTION_STATUSES
+from ratelimit import raise_if_throttled
+from encoding import dumps
+import tracing
+
+WS_MAX_IN_FLIGHT = int(os.getenv("WS_MAX_IN_FLIGHT", "16"))  # questions answered at once per connection
+
+
+def _error(e):
+    """
+    Error frame data for e, with the status the HTTP route would have answered.
+    """
+    if isinstance(e, ValidationError):
+        return {"status": 422, "detail": json.loads(e.json(include_url=False))}
+    if isinstance(e, Overloaded):
+        return {"status": 503, "detail": f"Server overloaded ({e}), retry in {e.retry_after}s",
+                "retry_after": e.retry_after}
+    try:
+        raise_if_throttled(e)
+    except HTTPException as throttled:
+        return {"status": 429, "detail": throttled.detail, "retry_after": int(throttled.headers["Retry-After"])}
+    if isinstance(e, HTTPException):
+        return {"status": e.status_code, "detail": e.detail}
+    return {"status": 500, "detail": str(e)}
+
+
+class ChatGateway:
+    """
+    Many questions, over any number of conversations, answered concurrently
+    over one WebSocket. The client tags each question with an id of its
+    choosing, a string or an integer; every frame of the answer carries
+    that id. Malformed messages, including binary frames, get an error
+    frame and leave the other questions running:
+
+        -> {"id": "q1", "type": "ask_agent", "query": "...", "user_id": "..."}
+        -> {"id": "q2", "type": "agent_chat", "user_message": "...", "conversation_id": "..."}
+        <- {"id": "q2", "event": "chunk", "data": {"text": "..."}}
+        <- {"id": "q1", "event": "chunk", "data": {"text": "..."}}
+        <- {"id": "q1", "event": "done", "data": {"session_id": "..."}}
+        -> {"id": "q2", "type": "cancel"}
+        <- {"id": "q2", "event": "cancelled", "data": {}}
+
+    Question fields are those of the matching HTTP route, and events are
+    the ones its streaming variant sends, with errors as {"status", "detail"}.
+    Cancelling a question, or closing the connection, cancels its upstream
+    call and closes its upstream stream, so abandoned questions stop using
+    AWS capacity. Questions go through the same admission control as their
+    HTTP routes.
+
+    handlers maps each question type to (request model, route path for
+    admission control, function from a request to its (event, data) frames).
+    """
+
+    def __init__(self, websocket, handlers, admission=None, max_in_flight=WS_MAX_IN_FLIGHT):
+        self.websocket = websocket
+        self.handlers = handlers
+        self.admission = admission
+        self.max_in_flight = max_in_flight
+        self.tasks = {}
+        self._send_lock = asyncio.Lock()
+
+    async def serve(self):
+        await self.websocket.accept()
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("text") is None:
+                    await self._send(None, "error", {"status": 400, "detail": "Messages must be text frames"})
+                    continue
+                await self._receive(message["text"])
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for task in self.tasks.values():
+                task.cancel()
+
+    async def _send(self, message_id, event, data):
+        async with self._send_lock:
+            await self.websocket.send_text(dumps({"id": message_id, "event": event, "data": data}).decode())
+
+    async def _receive(self, text):
+        try:
+            message = json.loads(text)
+            message_id, kind = message.get("id"), message.get("type")
+        except (ValueError, AttributeError):
+            return await self._send(None, "error", {"status": 400, "detail": "Messages must be JSON objects"})
+
+        if message_id is not None and (not isinstance(message_id, (str, int)) or isinstance(message_id, bool)):
+            return await self._send(None, "error", {"status": 400, "detail": "id must be a string or an integer"})
+        if kind == "cancel":
+            return await self._cancel(message_id)
+        if kind not in self.handlers:
+            return await self._send(message_id, "error", {
+                "status": 400, "detail": f"Unknown type {kind!r}, expected one of {[*self.handlers, 'cancel']}",
+            })
+        if message_id is None or message_id in self.tasks:
+            return await self._send(message_id, "error", {"status": 409, "detail": "Every question needs an id not in use"})
+        if len(self.tasks) >= self.max_in_flight:
+            return await self._send(message_id, "error", {
+                "status": 429, "detail": f"At most {self.max_in_flight} questions in flight per connection",
+            })
+
+        fields = {k: v for k, v in message.items() if k not in ("id", "type")}
+        self.tasks[message_id] = asyncio.create_task(self._answer(message_id, kind, fields))
+
+    async def _cancel(self, message_id):
+        task = self.tasks.get(message_id)
+        if task is None:
+            return await self._send(message_id, "error", {"status": 404, "detail": "No question in flight with this id"})
+        task.cancel()
+        await asyncio.wait([task])
+        await self._send(message_id, "cancelled", {})
+
+    async def _answer(self, message_id, kind, fields):
+        model, path, frames_for = self.handlers[kind]
+        limiter = self.admission.get(path) if self.admission is not None else None
+        traceparent = self.websocket.headers.get("traceparent")
+        try:
+            # Each question is traced as a request of its own
+            with tracing.root_span(f"WEBSOCKET {kind}", traceparent, attributes={"ws.route": path}):
+                request = model.model_validate(fields)
+                async with (admitted(limiter, ("WEBSOCKET", path)) if limiter else nullcontext({})) as outcome:
+                    frames = frames_for(request)
+                    try:
+                        async for event, data in frames:
+                            await self._send(message_id, event, data)
+                    except Exception as e:
+                        outcome["congested"] = _error(e)["status"] in CONGESTION_STATUSES
+                        raise
+                    finally:
+                        await frames.aclose()
+        except asyncio.CancelledError:
+            pass  # cancelled by the client (reported by _cancel) or the connection closed
+        except Exception as e:
+            await self._send(message_id, "error", _error(e))
+        finally:
+            self.tasks.pop(message_id, None)
@@ -1,88 +1,104 @@
-import os
 import uuid
-import boto3
-from fastapi import FastAPI, HTTPException
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from fastapi.encoders import jsonable_encoder
 from botocore.exceptions import ClientError
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 from typing import Optional
 
+# Load .env before the local modules below read their settings
 load_dotenv()
 
-app = FastAPI()
-
-# Allow React frontend
+from streaming import SSE_HEADERS, sse_event, iter_agent_text, chat_sync_events
+from aws_clients import run_aws, iterate_stream
+from cache import normalize_query
+from batch import ndjson_response
+from ratelimit import raise_if_throttled
+from admission import AdmissionMiddleware, record_upstream
+from gateway import ChatGateway
+from encoding import FastJSONResponse
+from compression import CompressionMiddleware
+import timing
+from timing import ServerTimingMiddleware
+import tracing
+from tracing import TracingMiddleware
+from projection import parse_fields, project
+import cassette
+from metrics import metrics, MetricsMiddleware
+from session_store import create_session_store
+from tenants import TenantRegistry, TenantMiddleware, current_tenant
+
+@asynccontextmanager
+async def lifespan(app):
+    # Clients are built lazily; warm them up in the background so startup is not blocked
+    tenants.start_warm_up()
+    yield
+    if cassette.cassette is not None:
+        cassette.cassette.close()
+    tracing.tracer.shutdown()  # export the last spans
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+session_store = create_session_store()  # store sessionIds per user, shared across workers with Redis
+
+# Every tenant (TENANTS=default,ak=_AK,...) is served by this one process, each with
+# its own credentials, clients and caches; see tenants.py
+tenants = TenantRegistry.from_env(session_store)
+app.add_middleware(MetricsMiddleware)  # inside TenantMiddleware, so it sees routes with the tenant prefix stripped
+app.add_middleware(AdmissionMiddleware, current_tenant=current_tenant)  # sheds load on the slow routes
+app.add_middleware(TracingMiddleware, current_tenant=current_tenant)  # spans cover admission and the handler
+app.add_middleware(TenantMiddleware, tenants=tenants)
+app.add_middleware(ServerTimingMiddleware)  # outside admission and tenants, so it sees the queue wait
+app.add_middleware(CompressionMiddleware)  # so every complete JSON body is compressed
+
+# Allow React frontend. Outermost, so preflights are answered before admission and
+# every response, including 503s from admission and 404s for unknown tenants, is readable
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Retry-After"],
 )
 
 
-
-AGENT_ID = os.getenv("BEDROCK_AGENT_ID")
-QS_TOPIC_ID = os.getenv("QS_TOPIC_ID")
-AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
-AWS_ACCOUNT_ID = os.getenv("AWS_ACCOUNT_ID", "803597461034")
-QUICKSIGHT_NAMESPACE = os.getenv("QUICKSIGHT_NAMESPACE", "default")
-AWS_PROFILE = os.getenv("AWS_PROFILE")  # SSO profile name
-AWS_USER_ARN = os.getenv("AWS_USER_ARN")
-AGENT_ALIAS_ID = "CUSTOMER_ANALYTICS_AGENT"
-Q_BUSINESS_APP_ID = os.getenv("Q_BUSINESS_APP_ID")
-USER_ID = os.getenv("USER_ID")
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_SESSION_TOKEN = os.getenv("AWS_SESSION_TOKEN")  # For temporary credentials
-
-# Initialize QuickSight client with access key/secret key
-if AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY:
-    print(f"🔐 Using AWS Access Key credentials")
-    session_kwargs = {
-        'aws_access_key_id': AWS_ACCESS_KEY_ID,
-        'aws_secret_access_key': AWS_SECRET_ACCESS_KEY,
-        'region_name': AWS_REGION
-    }
-    # Add session token if present (for temporary credentials)
-    if AWS_SESSION_TOKEN:
-        session_kwargs['aws_session_token'] = AWS_SESSION_TOKEN
-        print("Using temporary credentials with session token")
-    session = boto3.Session(**session_kwargs)
-else:
-    print(f"🔐 Using AWS Profile: {AWS_PROFILE}")
-    session = boto3.Session(profile_name=AWS_PROFILE, region_name=AWS_REGION)
-
-quicksight_client = session.client('quicksight')
-qs = quicksight_client
-sts_client = session.client('sts')
-
-# Setup AWS client
-bedrock_client = session.client(
-    "bedrock-agent-runtime",
-    region_name=os.getenv("AWS_REGION")
-)
-
-sessions = {}  # store sessionIds per user
-
-
-
-
 class QARequest(BaseModel):
     query_text: str
     include_generated_answer: Optional[bool] = True
     include_q_index: Optional[bool] = True
     max_topics: Optional[int] = 4
 
+class QABatchRequest(BaseModel):
+    items: list[QARequest]
+    max_concurrency: Optional[int] = Field(None, ge=1)
+
 class Query(BaseModel):
     query: str
     session_id: str | None = None
+    user_id: str | None = None  # continue this user's last session when session_id is omitted
 
-class ChatRequest(BaseModel):
+class AgentChatRequest(BaseModel):
     user_message: str
     conversation_id: Optional[str] = None
     parent_message_id: Optional[str] = None
+    user_id: Optional[str] = None  # whose server-side conversation to continue; without one, nothing is tracked
+    new_conversation: Optional[bool] = False
+
+class ChatRequest(BaseModel):
+    user_id: str
+    message: str
+    conversation_id: str | None = None
+    parent_message_id: str | None = None
+    new_conversation: bool | None = False
+    user_groups: list[str] | None = None
+    chat_mode: str | None = "RETRIEVAL_MODE"  # or CREATOR_MODE / PLUGIN_MODE
 
 class EmbedURLRequest(BaseModel):
     user_arn: str
@@ -90,106 +106,342 @@ class EmbedURLRequest(BaseModel):
     session_lifetime_minutes: Optional[int] = 600
 
 
+class BulkEmbedURLRequest(BaseModel):
+    user_arns: list[str]
+    agent_id: Optional[str] = None
+    session_lifetime_minutes: Optional[int] = 600
+    with_identity: Optional[bool] = False  # use embed-url-with-identity instead of embed-url
+    max_concurrency: Optional[int] = Field(None, ge=1)
+
+
 class EmbedURLResponse(BaseModel):
     embed_url: str
     status: int
 
+@app.get("/health")
+async def health():
+    """
+    Liveness: the process is up and serving.
+    """
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness: 503 until the startup warm-up (clients built, connections opened) has finished.
+    """
+    if not tenants.ready:
+        return JSONResponse(status_code=503, content={"ready": False})
+    return {
+        "ready": True,
+        "warmup_seconds": tenants.warmup_seconds,
+        "warmup_errors": tenants.warmup_errors,
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Latency histograms, rolling p50/p95/p99, errors and throttles per AWS operation and per route.
+    """
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/list-agent")
-def list_all_agents(max_results=100):
-    resp = bedrock_client.list_agents(maxResults=max_results)
-    agents = resp.get('agentSummaries', [])
-    next_token = resp.get('nextToken')
+async def list_all_agents(request: Request):
+    """
+    List Bedrock agents from the in-memory catalog (refreshed in the background).
+    """
+    tenant = current_tenant()
+    agents = await tenant.agent_catalog.get()
+    return tenant.agent_catalog.response(request, agents)
 
-    while next_token:
-        resp = bedrock_client.list_agents(maxResults=max_results, nextToken=next_token)
-        agents.extend(resp.get('agentSummaries', []))
-        next_token = resp.get('nextToken')
+async def _agent_chat_params(tenant, request: AgentChatRequest):
+    """
+    Q Business request parameters for an agent chat turn (all but the message),
+    with the user whose conversation it continues and the turns so far.
+    """
+    params = {
+        'applicationId': tenant.q_business_app_id,
+        'userId': tenant.user_id,
+    }
 
-    return agents
+    # If continuing a conversation, pass these IDs; when the client omits
+    # them, continue the user's conversation tracked on the server. Callers
+    # without a user_id are not tracked, so they never share a conversation
+    user_id = request.user_id
+    conversation_id, parent_message_id, turns = await tenant.conversations.resolve(
+        user_id, request.conversation_id, request.parent_message_id, request.new_conversation
+    )
+    if conversation_id:
+        params['conversationId'] = conversation_id
+    if parent_message_id:
+        params['parentMessageId'] = parent_message_id
+    return user_id, params, turns
 
 @app.post("/api/agent-chat")
-async def agent_chat(request: ChatRequest):
+async def agent_chat(request: AgentChatRequest, fields: Optional[str] = None):
     """
     Talks to the Unified 'Quick Suite' Agent (Amazon Q Business + QuickSight Plugin)
+
+    fields= returns only the given fields, e.g. system_message,source_attributions.url
     """
-    client = boto3.client('qbusiness', region_name=AWS_REGION)
+    tenant = current_tenant()
+    projection = parse_fields(fields)
 
     try:
-        # Prepare arguments
-        kwargs = {
-            'applicationId': Q_BUSINESS_APP_ID,
-            'userId': USER_ID,
-            'userMessage': request.user_message,
-        }
-        
-        # If continuing a conversation, pass these IDs
-        if request.conversation_id:
-            kwargs['conversationId'] = request.conversation_id
-        if request.parent_message_id:
-            kwargs['parentMessageId'] = request.parent_message_id
+        user_id, params, turns = await _agent_chat_params(tenant, request)
 
         # Call the synchronous Chat API
-        response = client.chat_sync(**kwargs)
+        response = await tenant.qbusiness.chat_sync(**params, userMessage=request.user_message)
 
-        return {
+        await tenant.conversations.advance(user_id, response.get('conversationId'), response.get('systemMessageId'), turns)
+
+        return FastJSONResponse(project({
             "system_message": response.get('systemMessage'),
             "conversation_id": response.get('conversationId'),
             "parent_message_id": response.get('systemMessageId'),
-            "source_attributions": response.get('sourceAttributions', []) 
+            "source_attributions": response.get('sourceAttributions', []),
             # ^ This contains links to the Dashboards or Docs used to answer
-        }
+            "turns": turns + 1
+        }, projection))
 
     except Exception as e:
+        raise_if_throttled(e)
         print(f"Error calling Q Business: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _agent_chat_frames(tenant, request: AgentChatRequest):
+    """
+    An agent chat turn as (event, data) frames; see _qbusiness_chat_frames.
+    """
+    user_id, params, turns = await _agent_chat_params(tenant, request)
+    frames = _qbusiness_chat_frames(
+        tenant, user_id, params, request.user_message, turns,
+        final=lambda metadata: {
+            "conversation_id": metadata.get('conversationId'),
+            "parent_message_id": metadata.get('systemMessageId'),
+            "source_attributions": metadata.get('sourceAttributions', []),
+            "turns": turns + 1,
+        },
+    )
+    async for frame in frames:
+        yield frame
+
+@app.post("/api/agent-chat/stream")
+async def agent_chat_stream(request: AgentChatRequest):
+    """
+    Same as /api/agent-chat, but streams the answer as Server-Sent Events
+    while Q Business produces it; see _qbusiness_chat_frames for the events.
+    501 when the Q Business client cannot stream; see _require_streaming_chat.
+    """
+    tenant = current_tenant()
+    await _require_streaming_chat(tenant, "/api/agent-chat")
+    return await _sse_response(_agent_chat_frames(tenant, request))
+
+async def _require_streaming_chat(tenant, fallback_route):
+    """
+    Refuse a streaming route with 501 when the Q Business client has no
+    chat(). boto3 does not generate methods for operations whose input is an
+    event stream, so today that is every live client: streaming the answer
+    as one chunk once ChatSync completes would only add latency, and
+    fallback_route answers the same question directly.
+    """
+    if not await tenant.qbusiness.has_operation('chat'):
+        raise HTTPException(
+            status_code=501,
+            detail=f"Streaming Q Business answers is not supported by this AWS SDK; use {fallback_route}",
+        )
+
+async def _qbusiness_chat(tenant, params, message, chat_mode=None):
+    """
+    Ask Q Business and yield its answer as Chat API output events, (name,
+    payload) pairs, as they arrive: textEvent deltas, then a metadataEvent
+    with the source attributions and message IDs.
+
+    Chat takes its input as an event stream, which boto3 does not generate
+    client methods for, so with a client that has no chat() this falls back
+    to ChatSync and yields the whole answer as one textEvent once complete.
+    The HTTP streaming routes refuse such clients up front; the WebSocket
+    gateway, where cancellation is the point, uses the fallback.
+    """
+    if not await tenant.qbusiness.has_operation('chat'):
+        sync_params = dict(params, userMessage=message)
+        if chat_mode:
+            sync_params['chatMode'] = chat_mode
+        for event in chat_sync_events(await tenant.qbusiness.chat_sync(**sync_params)):
+            yield event
+        return
+
+    input_stream = []
+    if chat_mode:
+        input_stream.append({'configurationEvent': {'chatMode': chat_mode}})
+    input_stream += [{'textEvent': {'userMessage': message}}, {'endOfInputEvent': {}}]
+
+    response = await tenant.qbusiness.chat(**params, inputStream=input_stream)
+    async for event in iterate_stream(response['outputStream']):
+        for name, payload in event.items():
+            yield name, payload
+
+async def _qbusiness_chat_frames(tenant, user_id, params, message, turns, final, chat_mode=None):
+    """
+    A Q Business answer as (event, data) frames for the client, as it is
+    produced:
+
+        chunk: {"text": "..."}          answer text
+        actionReview / authChallengeRequest / failedAttachment: {...}
+                                        as Q Business sends them (plugins, attachments)
+        done:  final(metadata)          last: message IDs and source attributions
+
+    The user's server-side conversation advances before done is sent.
+    """
+    metadata = {}
+    async for name, payload in _qbusiness_chat(tenant, params, message, chat_mode):
+        if name == 'textEvent':
+            yield "chunk", {"text": payload.get('systemMessage') or ""}
+        elif name == 'metadataEvent':
+            metadata = payload
+        else:
+            yield name.removesuffix('Event'), jsonable_encoder(payload)
+
+    if metadata.get('conversationId'):
+        await tenant.conversations.advance(user_id, metadata['conversationId'], metadata.get('systemMessageId'), turns)
+    yield "done", jsonable_encoder(final(metadata))
+
+async def _sse_response(frames):
+    """
+    Stream (event, data) frames to the client as Server-Sent Events.
+    Upstream errors before the first frame get a proper status (429 when
+    throttled); after that they end the stream with an error event,
+    {"detail": "..."}. A client that goes away closes the frames, and with
+    them any upstream stream.
+    """
+    try:
+        with timing.phase("first_event", "until the first streamed event"):
+            first = await anext(frames)
+    except Exception as e:
+        raise_if_throttled(e)
+        print(f"Error calling upstream: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        frame = first
+        try:
+            while frame is not None:
+                event, data = frame
+                yield sse_event(data, event=event)
+                frame = await anext(frames, None)
+        except Exception as e:
+            print(f"Error streaming upstream response: {e}")
+            yield sse_event({"detail": str(e)}, event="error")
+        finally:
+            await frames.aclose()
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+async def _agent_session_id(tenant, data: Query):
+    """
+    Bedrock session to use: the one given, else the user's stored one, else a new one.
+    """
+    if data.session_id:
+        return data.session_id
+    if data.user_id:
+        record = await session_store.get(tenant.session_key(f"agent:{data.user_id}"))
+        if record and record.get("session_id"):
+            return record["session_id"]
+    return str(uuid.uuid4())
+
 @app.post("/ask-agent")
-def ask_agent(data: Query):
+async def ask_agent(data: Query):
     # Create session for user if not exists
-    session_id = data.session_id or str(uuid.uuid4())
+    tenant = current_tenant()
+    session_id = await _agent_session_id(tenant, data)
 
-    # Call invoke_agent
-    response = bedrock_client.invoke_agent(
-        agentId=AGENT_ID,
-        agentAliasId=AGENT_ALIAS_ID,
-        enableTrace=False,
-        sessionId=session_id,
-        inputText=data.query
-    )
+    try:
+        # Call invoke_agent
+        response = await tenant.bedrock.invoke_agent(
+            agentId=tenant.agent_id,
+            agentAliasId=tenant.agent_alias_id,
+            enableTrace=False,
+            sessionId=session_id,
+            inputText=data.query
+        )
 
-      # Bedrock Agent Runtime streams output — extract first text chunk
-    chunks = []
-    for event in response.get("completion", []):
-        if "textResponse" in event:
-            chunks.append(event["textResponse"]["body"])
+        # Bedrock Agent Runtime streams output — reading it blocks too, so drain it off the loop
+        with timing.phase("completion", "reading the agent's completion stream"), tracing.span("event stream") as read_span:
+            answer = await run_aws(lambda: "".join(iter_agent_text(response.get("completion", []))))
+            if read_span is not None:
+                read_span.set_attribute("stream.payload_bytes", len(answer.encode("utf-8")))
+    except ClientError as e:
+        raise_if_throttled(e)
+        error_code = e.response['Error']['Code']
+        error_message = e.response['Error']['Message']
+        raise HTTPException(status_code=500, detail=f"AWS Error ({error_code}): {error_message}")
 
-    answer = "".join(chunks)
+    if data.user_id:
+        await session_store.update(tenant.session_key(f"agent:{data.user_id}"), session_id=session_id)
 
     return {
         "session_id": session_id,
         "answer": answer
     }
 
+async def _ask_agent_frames(tenant, data: Query):
+    """
+    An /ask-agent question as (event, data) frames: chunk {"text": "..."} per
+    completion chunk as Bedrock produces it, then done {"session_id": "..."}.
+    """
+    session_id = await _agent_session_id(tenant, data)
+
+    response = await tenant.bedrock.invoke_agent(
+        agentId=tenant.agent_id,
+        agentAliasId=tenant.agent_alias_id,
+        enableTrace=False,
+        sessionId=session_id,
+        inputText=data.query
+    )
+
+    if data.user_id:
+        await session_store.update(tenant.session_key(f"agent:{data.user_id}"), session_id=session_id)
+
+    async for event in iterate_stream(response.get("completion", [])):
+        for text in iter_agent_text([event]):
+            yield "chunk", {"text": text}
+    yield "done", {"session_id": session_id}
+
+@app.post("/ask-agent/stream")
+async def ask_agent_stream(data: Query):
+    """
+    Same as /ask-agent, but forwards each completion chunk to the client as a
+    Server-Sent Event as soon as Bedrock produces it.
+
+    Events:
+        chunk: {"text": "..."}          one per completion chunk
+        error: {"detail": "..."}        if the agent stream fails midway; last
+        done:  {"session_id": "..."}    last otherwise
+
+    Upstream errors before the first chunk get a status instead (429 when
+    throttled); see _sse_response.
+    """
+    return await _sse_response(_ask_agent_frames(current_tenant(), data))
+
 @app.get("/api/quicksight/list-topics")
-async def list_topics():
+async def list_topics(request: Request):
     """
     List available QuickSight Q topics.
     This helps you understand what data sources are available for Q&A.
     """
+    tenant = current_tenant()
     try:
-        response = quicksight_client.list_topics(
-            AwsAccountId=AWS_ACCOUNT_ID
-        )
-        
-        topics = response.get('TopicsSummaries', [])
+        # Served from the in-memory catalog (refreshed in the background)
+        topics = await tenant.topic_catalog.get()
         
-        return {
+        return tenant.topic_catalog.response(request, {
             "topics": topics,
             "count": len(topics),
             "status": 200
-        }
+        })
         
     except ClientError as e:
+        raise_if_throttled(e)
         error_code = e.response['Error']['Code']
         error_message = e.response['Error']['Message']
         raise HTTPException(
@@ -198,15 +450,33 @@ async def list_topics():
         )
 
 
+@app.post("/api/catalog/refresh")
+async def refresh_catalog():
+    """
+    Reload the topic and agent catalogs from AWS now, e.g. after publishing a topic.
+    """
+    tenant = current_tenant()
+    try:
+        await asyncio.gather(tenant.topic_catalog.refresh(), tenant.agent_catalog.refresh())
+    except Exception as e:
+        raise_if_throttled(e)
+        raise HTTPException(status_code=500, detail=f"Error refreshing catalog: {str(e)}")
+    return {
+        "topics": tenant.topic_catalog.info(),
+        "agents": tenant.agent_catalog.info()
+    }
+
+
 @app.get("/api/quicksight/user-info")
 async def get_user_info():
     """
     Get information about the current QuickSight user.
     Useful for debugging authentication issues.
     """
+    tenant = current_tenant()
     try:
         # First, let's see who we are in AWS
-        identity = sts_client.get_caller_identity()
+        identity = await tenant.sts.get_caller_identity()
         print("identity", identity);
         
         # Try to find a QuickSight user
@@ -216,10 +486,10 @@ async def get_user_info():
             username = arn_parts[-1] if len(arn_parts) > 0 else 'unknown'
             
             # Try to describe the user
-            user_response = quicksight_client.describe_user(
+            user_response = await tenant.quicksight.describe_user(
                 UserName=username,
-                AwsAccountId=AWS_ACCOUNT_ID,
-                Namespace=QUICKSIGHT_NAMESPACE
+                AwsAccountId=tenant.account_id,
+                Namespace=tenant.quicksight_namespace
             )
 
 
@@ -239,6 +509,7 @@ async def get_user_info():
             }
             
     except Exception as e:
+        raise_if_throttled(e)
         raise HTTPException(
             status_code=500,
             detail=f"Error getting user info: {str(e)}"
@@ -246,24 +517,20 @@ async def get_user_info():
 
 
 @app.post("/api/quicksight/predict-qa2")
-def predict_qa2(req: QARequest):
-    # Assume a role that has QuickSight access
-    assumed_role = sts_client.assume_role(
-        RoleArn='arn:aws:iam::803597461034:role/QuickSightRole',
-        RoleSessionName='QuickSightSession'
+async def predict_qa2(req: QARequest):
+    tenant = current_tenant()
+
+    # Use a role that has QuickSight access; its credentials are assumed once
+    # and refreshed in the background before they expire
+    qs = tenant.client(
+        'quicksight',
+        region_name='us-east-1',
+        role_arn=f'arn:aws:iam::{tenant.account_id}:role/QuickSightRole',
+        role_session_name='QuickSightSession'
     )
 
-    qs_session = boto3.Session(
-        aws_access_key_id=assumed_role['Credentials']['AccessKeyId'],
-        aws_secret_access_key=assumed_role['Credentials']['SecretAccessKey'],
-        aws_session_token=assumed_role['Credentials']['SessionToken'],
-        region_name='us-east-1'
-    )
-
-    qs = qs_session.client('quicksight')
-
-    response = qs.predict_qa_results(
-        AwsAccountId=AWS_ACCOUNT_ID,
+    response = await qs.predict_qa_results(
+        AwsAccountId=tenant.account_id,
         QueryText='what are partners to date?',
         IncludeQuickSightQIndex='INCLUDE',
         IncludeGeneratedAnswer='INCLUDE'
@@ -271,30 +538,63 @@ def predict_qa2(req: QARequest):
 
     print("response", response);
 
-@app.post("/api/quicksight/predict-qa")
-def predict_qa(req: QARequest):
+async def _shared_aws_call(tenant, name, key, fn):
+    """
+    tenant.inflight.do(key, fn), accounted to the current request. The shared
+    call runs detached from every caller (see SingleFlight), so each one
+    records its own wait as the AWS call in its trace, Server-Timing and
+    admission latency.
+    """
+    start = time.perf_counter()
+    with tracing.span(name, tracing.CLIENT, {"aws.shared_call": True}):
+        try:
+            return await tenant.inflight.do(key, fn)
+        finally:
+            waited = time.perf_counter() - start
+            record_upstream(waited)
+            timing.record(name, waited, f"AWS {name}")
+
+async def _predict_qa(tenant, req: QARequest):
     
     # optional session id
     # if req.sessionId:
     #     payload["SessionId"] = req.sessionId
 
+    include_q_index = 'INCLUDE' if req.include_q_index else 'EXCLUDE'
+    include_generated_answer = 'INCLUDE' if req.include_generated_answer else 'EXCLUDE'
+    max_topics = req.max_topics or 4
+
+    # Same question with the same options within the TTL -> serve from cache
+    cache_key = (normalize_query(req.query_text), max_topics, include_generated_answer, include_q_index)
+    cached = tenant.qa_cache.get(cache_key)
+    if cached is not None:
+        return {**cached, "cached": True}
+
     # ---- CALL QUICK SIGHT API ----
 
+    # A call that started before an invalidate neither refills the cache nor is joined after it
+    generation = tenant.qa_cache.generation
     try:
-        response = quicksight_client.predict_qa_results(
-            AwsAccountId=AWS_ACCOUNT_ID,
-            QueryText=req.query_text,
-            IncludeQuickSightQIndex='INCLUDE',
-            IncludeGeneratedAnswer='INCLUDE',
-            MaxTopicsToConsider=4
+        response = await _shared_aws_call(
+            tenant, "predict_qa_results", ("predict_qa_results", cache_key, generation),
+            lambda: tenant.quicksight.predict_qa_results(
+                AwsAccountId=tenant.account_id,
+                QueryText=req.query_text,
+                IncludeQuickSightQIndex=include_q_index,
+                IncludeGeneratedAnswer=include_generated_answer,
+                MaxTopicsToConsider=max_topics
+            )
         )
         
-        return {
+        result = {
                 "primary_result": response.get("PrimaryResult"),
                 "additional_results": response.get("AdditionalResults", []),
                 "request_id": response.get("RequestId")
             }
+        tenant.qa_cache.set(cache_key, result, generation=generation)
+        return {**result, "cached": False}
     except ClientError as e:
+        raise_if_throttled(e)
         print("e.response ++++", e.response)
         error_code = e.response['Error']['Code']
         error_message = e.response['Error']['Message']
@@ -323,54 +623,90 @@ def predict_qa(req: QARequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/get-embed-url/")
-def get_embed_url():
-    session = boto3.Session(profile_name=AWS_PROFILE)
-    qs = session.client("quicksight", region_name="us-east-1")
-
-    response = qs.generate_embed_url_for_registered_user(
-        AwsAccountId=AWS_ACCOUNT_ID,
-        UserArn=AWS_USER_ARN,
-        ExperienceConfiguration={"QuickChat": {}},
-        AllowedDomains=[
-            "http://localhost:3000"  # your local React domain
-        ]
-    )
-    
-    return {"embedUrl": response["EmbedUrl"]}
+@app.post("/api/quicksight/predict-qa")
+async def predict_qa(req: QARequest, fields: Optional[str] = None):
+    """
+    fields= returns only the given fields, e.g. primary_result.GeneratedAnswer.Answer,request_id
+    """
+    projection = parse_fields(fields)
+    return FastJSONResponse(project(await _predict_qa(current_tenant(), req), projection))
 
-@app.post("/api/quicksight/embed-url", response_model=EmbedURLResponse)
-async def generate_embed_url(request: EmbedURLRequest):
+@app.post("/api/quicksight/predict-qa/batch")
+async def predict_qa_batch(req: QABatchRequest, fields: Optional[str] = None):
     """
-    Generate a secure embed URL for QuickSight Chat Agent.
-    
-    Args:
-        request: Contains user_arn, optional agent_id, and session lifetime
-        
-    Returns:
-        EmbedURLResponse with the generated embed URL
+    Answer many questions in one request: they run against QuickSight
+    concurrently (up to max_concurrency, capped by BATCH_MAX_CONCURRENCY) and
+    each result is streamed back as an NDJSON line as soon as it is ready.
+    A failed question reports its error on its own line; the others still run.
+    fields= applies to each result, as for a single question.
+    """
+    tenant = current_tenant()
+    projection = parse_fields(fields)
+
+    async def answer(item):
+        return project(await _predict_qa(tenant, item), projection)
+
+    return ndjson_response(req.items, answer, req.max_concurrency)
+
+@app.get("/api/quicksight/predict-qa/cache")
+async def predict_qa_cache_stats():
+    """
+    predict-qa result cache size and hit/miss counts.
+    """
+    return current_tenant().qa_cache.stats()
+
+@app.post("/api/quicksight/predict-qa/cache/invalidate")
+async def invalidate_predict_qa_cache():
     """
+    Drop every cached predict-qa result, e.g. after QuickSight topics are refreshed.
+    """
+    return {"invalidated": current_tenant().qa_cache.clear()}
+
+@app.get("/get-embed-url")
+@app.get("/get-embed-url/")
+async def get_embed_url():
+    tenant = current_tenant()
+
+    try:
+        response = await tenant.embed_pool.get(
+            ("get-embed-url", tenant.user_arn),
+            lambda: tenant.quicksight.generate_embed_url_for_registered_user(
+                AwsAccountId=tenant.account_id,
+                UserArn=tenant.user_arn,
+                ExperienceConfiguration={"QuickChat": {}},
+                AllowedDomains=tenant.allowed_domains  # your React / iframe domain
+            )
+        )
+    except ClientError as e:
+        raise_if_throttled(e)
+        error_code = e.response['Error']['Code']
+        error_message = e.response['Error']['Message']
+        raise HTTPException(status_code=500, detail=f"AWS Error ({error_code}): {error_message}")
+
+    return {"embedUrl": response["EmbedUrl"]}
+
+async def _generate_embed_url(tenant, request: EmbedURLRequest, pooled=True):
     try:
         # Prepare experience configuration for QuickChat
         experience_configuration = {
             'QuickChat': {}
         }
-        agent_id = '591980bf-7fe1-4554-be08-6c268c1a3ace'
-        # If a specific agent is provided, add it to the configuration
         
-        agent_arn = f"arn:aws:quicksight:{AWS_REGION}:{AWS_ACCOUNT_ID}:agent/{agent_id}"
-        experience_configuration['QuickChat'] = {
-            
-        }
-        
-        # Generate embed URL
-        response = quicksight_client.generate_embed_url_for_registered_user(
-            AwsAccountId=AWS_ACCOUNT_ID,
+        generate = lambda: tenant.quicksight.generate_embed_url_for_registered_user(
+            AwsAccountId=tenant.account_id,
             SessionLifetimeInMinutes=request.session_lifetime_minutes,
             UserArn=request.user_arn,
             ExperienceConfiguration=experience_configuration,
-            AllowedDomains=['http://localhost:3000']  # Update with your domains
+            AllowedDomains=tenant.allowed_domains  # Update with your domains
         )
+
+        # Generate embed URL (served from the per-user pool when one is ready)
+        if pooled:
+            response = await tenant.embed_pool.get(
+                ("embed-url", request.user_arn, request.session_lifetime_minutes), generate
+            )
+        else:
+            response = await generate()
         
         return EmbedURLResponse(
             embed_url=response['EmbedUrl'],
@@ -378,6 +714,7 @@ async def generate_embed_url(request: EmbedURLRequest):
         )
         
     except ClientError as e:
+        raise_if_throttled(e)
         error_code = e.response['Error']['Code']
         error_message = e.response['Error']['Message']
         raise HTTPException(
@@ -390,30 +727,52 @@ async def generate_embed_url(request: EmbedURLRequest):
             detail=f"Error generating embed URL: {str(e)}"
         )
 
+@app.post("/api/quicksight/embed-url", response_model=EmbedURLResponse)
+async def generate_embed_url(request: EmbedURLRequest):
+    """
+    Generate a secure embed URL for QuickSight Chat Agent.
+    
+    Args:
+        request: Contains user_arn, optional agent_id, and session lifetime
+        
+    Returns:
+        EmbedURLResponse with the generated embed URL
+    """
+    return await _generate_embed_url(current_tenant(), request)
+
 
-@app.post("/api/quicksight/embed-url-with-identity", response_model=EmbedURLResponse)
-async def generate_embed_url_with_identity(request: EmbedURLRequest):
+@app.get("/api/quicksight/embed-url-pool")
+async def embed_url_pool_stats():
     """
-    Generate embed URL using identity federation (no pre-provisioned QuickSight user needed).
-    This is useful for dynamic user provisioning.
+    Embed URL pool hit/miss counts and refill latency.
     """
+    return current_tenant().embed_pool.stats()
+
+@app.get("/api/admission")
+async def admission_stats():
+    """
+    Current concurrency limit, in-flight and queued requests, and shed counts per limited route.
+    """
+    return current_tenant().admission.stats()
+
+async def _generate_embed_url_with_identity(tenant, request: EmbedURLRequest):
     try:
         experience_configuration = {
             'QuickChat': {}
         }
         
         if request.agent_id:
-            agent_arn = f"arn:aws:quicksight:{AWS_REGION}:{AWS_ACCOUNT_ID}:agent/{request.agent_id}"
+            agent_arn = f"arn:aws:quicksight:{tenant.region}:{tenant.account_id}:agent/{request.agent_id}"
             experience_configuration['QuickChat']['InitialAgentConfiguration'] = {
                 'InitialAgentArn': agent_arn
             }
         
-        response = quicksight_client.generate_embed_url_for_registered_user_with_identity(
-            AwsAccountId=AWS_ACCOUNT_ID,
+        response = await tenant.quicksight.generate_embed_url_for_registered_user_with_identity(
+            AwsAccountId=tenant.account_id,
             SessionLifetimeInMinutes=request.session_lifetime_minutes,
             UserArn=request.user_arn,
             ExperienceConfiguration=experience_configuration,
-            AllowedDomains=['http://localhost:3000']
+            AllowedDomains=tenant.allowed_domains
         )
         
         return EmbedURLResponse(
@@ -422,6 +781,7 @@ async def generate_embed_url_with_identity(request: EmbedURLRequest):
         )
         
     except ClientError as e:
+        raise_if_throttled(e)
         error_code = e.response['Error']['Code']
         error_message = e.response['Error']['Message']
         raise HTTPException(
@@ -433,3 +793,145 @@ async def generate_embed_url_with_identity(request: EmbedURLRequest):
             status_code=500,
             detail=f"Error generating embed URL: {str(e)}"
         )
+
+@app.post("/api/quicksight/embed-url-with-identity", response_model=EmbedURLResponse)
+async def generate_embed_url_with_identity(request: EmbedURLRequest):
+    """
+    Generate embed URL using identity federation (no pre-provisioned QuickSight user needed).
+    This is useful for dynamic user provisioning.
+    """
+    return await _generate_embed_url_with_identity(current_tenant(), request)
+
+@app.post("/api/quicksight/embed-urls")
+async def generate_embed_urls(request: BulkEmbedURLRequest):
+    """
+    Embed URLs for many users at once, e.g. for everyone starting a shift.
+
+    URLs are generated concurrently (up to max_concurrency, capped by
+    BATCH_MAX_CONCURRENCY) and streamed back as NDJSON lines as they complete;
+    a failed user reports its error on its own line. Calls to QuickSight go
+    through the tenant's GenerateEmbedUrl rate limits (AWS_RATE_LIMITS), so a
+    large batch is paced instead of throttled. The per-user URL pool is
+    bypassed: pre-generating spare URLs for every user in the batch would
+    triple the calls exactly when the rate limit is tightest.
+    """
+    tenant = current_tenant()
+
+    async def embed_url(user_arn):
+        embed_request = EmbedURLRequest(
+            user_arn=user_arn,
+            agent_id=request.agent_id,
+            session_lifetime_minutes=request.session_lifetime_minutes,
+        )
+        if request.with_identity:
+            response = await _generate_embed_url_with_identity(tenant, embed_request)
+        else:
+            response = await _generate_embed_url(tenant, embed_request, pooled=False)
+        return {"user_arn": user_arn, "embed_url": response.embed_url, "status": response.status}
+
+    return ndjson_response(request.user_arns, embed_url, request.max_concurrency)
+
+
+async def _chatsync_params(tenant, req: ChatRequest):
+    """
+    Q Business request parameters for a /chatsync turn (all but the message
+    and chat mode), with the turns so far.
+    """
+    params = {
+        "applicationId": tenant.q_business_app_id,     # REQUIRED
+        "userId": req.user_id,                         # User Identity
+    }
+
+    # Optional groups for access control
+    if req.user_groups:
+        params["userGroups"] = req.user_groups
+
+    # Continue an existing conversation: the one given, else the user's
+    # conversation tracked on the server. Without either, Q Business starts a new one.
+    conversation_id, parent_message_id, turns = await tenant.conversations.resolve(
+        req.user_id, req.conversation_id, req.parent_message_id, req.new_conversation
+    )
+    if conversation_id:
+        params["conversationId"] = conversation_id
+    if parent_message_id:
+        params["parentMessageId"] = parent_message_id
+    return params, turns
+
+@app.post("/chatsync")
+async def chat_with_qbusiness(req: ChatRequest, fields: Optional[str] = None):
+    """
+    Use Amazon Q Business ChatSync to answer an NLP question.
+
+    fields= returns only the given fields, e.g. systemMessage,sourceAttributions.url
+    """
+    tenant = current_tenant()
+    projection = parse_fields(fields)
+
+    try:
+        params, turns = await _chatsync_params(tenant, req)
+
+        # Call AWS ChatSync
+        response = await tenant.qbusiness.chat_sync(
+            **params,
+            userMessage=req.message,                   # The user's question
+            chatMode=req.chat_mode,                    # RETRIEVAL_MODE recommended
+        )
+
+        await tenant.conversations.advance(req.user_id, response.get("conversationId"), response.get("systemMessageId"), turns)
+
+        return FastJSONResponse(project({
+            "conversationId": response.get("conversationId"),
+            "systemMessage": response.get("systemMessage"),
+            "systemMessageId": response.get("systemMessageId"),
+            "userMessageId": response.get("userMessageId"),
+            "sourceAttributions": response.get("sourceAttributions", []),
+            "turns": turns + 1,
+        }, projection))
+
+    except Exception as e:
+        raise_if_throttled(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _chatsync_frames(tenant, req: ChatRequest):
+    """
+    A /chatsync turn as (event, data) frames; see _qbusiness_chat_frames.
+    """
+    params, turns = await _chatsync_params(tenant, req)
+    frames = _qbusiness_chat_frames(
+        tenant, req.user_id, params, req.message, turns, chat_mode=req.chat_mode,
+        final=lambda metadata: {
+            "conversationId": metadata.get("conversationId"),
+            "systemMessageId": metadata.get("systemMessageId"),
+            "userMessageId": metadata.get("userMessageId"),
+            "sourceAttributions": metadata.get("sourceAttributions", []),
+            "turns": turns + 1,
+        },
+    )
+    async for frame in frames:
+        yield frame
+
+@app.post("/chatsync/stream")
+async def chat_with_qbusiness_stream(req: ChatRequest):
+    """
+    Same as /chatsync, but streams the answer as Server-Sent Events while
+    Q Business produces it; see _qbusiness_chat_frames for the events.
+    501 when the Q Business client cannot stream; see _require_streaming_chat.
+    """
+    tenant = current_tenant()
+    await _require_streaming_chat(tenant, "/chatsync")
+    return await _sse_response(_chatsync_frames(tenant, req))
+
+@app.websocket("/ws/chat")
+async def chat_gateway(websocket: WebSocket):
+    """
+    One connection for every chat turn, with many questions in flight at
+    once: ask_agent and agent_chat, streamed (agent_chat as one chunk when
+    the Q Business client cannot stream), correlated by id and cancellable.
+    See gateway.ChatGateway for the protocol.
+    """
+    tenant = current_tenant()
+    gateway = ChatGateway(websocket, {
+        "ask_agent": (Query, "/ask-agent", lambda data: _ask_agent_frames(tenant, data)),
+        "agent_chat": (AgentChatRequest, "/api/agent-chat", lambda request: _agent_chat_frames(tenant, request)),
+    }, admission=tenant.admission)
+    await gateway.serve()
@@ -0,0 +1,242 @@
+import os
+import time
+import bisect
+import threading
+
+# Latest samples kept per series for the rolling p50/p95/p99
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1024"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Error codes AWS services use for throttling (same set botocore's standard retry mode treats as throttles)
+THROTTLE_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'ProvisionedThroughputExceededException', 'RequestLimitExceeded',
+    'BandwidthLimitExceeded', 'LimitExceededException', 'RequestThrottled', 'SlowDown',
+    'throttlingException',  # as raised inside Bedrock event streams
+}
+
+FAMILIES = {
+    # family: (metric name prefix, label names, what is timed, {counter: description})
+    "aws": ("aws_request", ("service", "operation"), "AWS API calls", {
+        "errors": "Number of failed AWS API calls.",
+        "throttles": "Number of throttled AWS API call attempts, including ones a retry absorbed.",
+        "retries": "Number of retried AWS API call attempts.",
+    }),
+    "http": ("http_request", ("method", "route"), "HTTP requests", {
+        "errors": "Number of HTTP requests answered with a 5xx.",
+        "throttles": "Number of HTTP requests answered with a 429.",
+    }),
+    "ratelimit": ("aws_rate_limit_wait", ("service", "method"), "waits for a client-side rate limit token", {
+        "rejected": "Number of AWS API calls rejected because the rate limit queue was full.",
+    }),
+    "admission": ("http_admission_wait", ("method", "route"), "waits for a route's admission slot", {
+        "rejected": "Number of HTTP requests shed with a 503 because the route was overloaded.",
+    }),
+}
+
+
+class LatencySeries:
+    """
+    Cumulative latency histogram plus a ring buffer of the latest samples
+    for quantiles. Memory is fixed: one counter per bucket and window floats.
+    """
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.counters = {}
+        self._window = [0.0] * window
+        self._next = 0
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        if i < len(self.buckets):
+            self.buckets[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self._window[self._next % len(self._window)] = seconds
+        self._next += 1
+
+    def samples(self):
+        return self._window[:min(self._next, len(self._window))]
+
+
+def quantiles(samples):
+    samples = sorted(samples)
+    return {q: samples[min(len(samples) - 1, int(q * len(samples)))] for q in QUANTILES}
+
+
+class Metrics:
+    """
+    Latency, error and throttle counts per AWS operation and per route,
+    rendered in the Prometheus text format. Thread-safe: AWS calls are
+    recorded from the executor threads.
+    """
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self._series = {}  # (family, labels) -> LatencySeries
+        self._lock = threading.Lock()
+
+    def _get(self, family, labels):
+        series = self._series.get((family, labels))
+        if series is None:
+            series = self._series[(family, labels)] = LatencySeries(self.window)
+        return series
+
+    def observe(self, family, labels, seconds, error=False):
+        with self._lock:
+            series = self._get(family, labels)
+            series.observe(seconds)
+            if error:
+                series.counters["errors"] = series.counters.get("errors", 0) + 1
+
+    def count(self, family, labels, counter, n=1):
+        with self._lock:
+            series = self._get(family, labels)
+            series.counters[counter] = series.counters.get(counter, 0) + n
+
+    def render(self):
+        with self._lock:
+            series = {
+                key: (list(s.buckets), s.count, s.sum, dict(s.counters), s.samples())
+                for key, s in self._series.items()
+            }
+
+        lines = []
+        for family, (prefix, label_names, what, counters) in FAMILIES.items():
+            rows = [(labels, data) for (f, labels), data in sorted(series.items()) if f == family]
+            if not rows:
+                continue
+
+            lines += [f"# HELP {prefix}_duration_seconds Latency of {what}.",
+                      f"# TYPE {prefix}_duration_seconds histogram"]
+            for labels, (buckets, count, total, _, _) in rows:
+                base = _labels(label_names, labels)
+                cumulative = 0
+                for le, n in zip(LATENCY_BUCKETS, buckets):
+                    cumulative += n
+                    lines.append(f'{prefix}_duration_seconds_bucket{{{base},le="{le}"}} {cumulative}')
+                lines.append(f'{prefix}_duration_seconds_bucket{{{base},le="+Inf"}} {count}')
+                lines.append(f"{prefix}_duration_seconds_sum{{{base}}} {total}")
+                lines.append(f"{prefix}_duration_seconds_count{{{base}}} {count}")
+
+            lines += [f"# HELP {prefix}_latency_seconds Latency quantiles over the last {self.window} {what}.",
+                      f"# TYPE {prefix}_latency_seconds summary"]
+            for labels, (_, _, _, _, samples) in rows:
+                base = _labels(label_names, labels)
+                if samples:
+                    for q, value in quantiles(samples).items():
+                        lines.append(f'{prefix}_latency_seconds{{{base},quantile="{q}"}} {value}')
+
+            for name, description in counters.items():
+                lines += [f"# HELP {prefix}_{name}_total {description}",
+                          f"# TYPE {prefix}_{name}_total counter"]
+                for labels, (_, _, _, counts, _) in rows:
+                    lines.append(f"{prefix}_{name}_total{{{_labels(label_names, labels)}}} {counts.get(name, 0)}")
+
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+def _labels(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
+
+
+# --- AWS calls: botocore event hooks -----------------------------------------
+# Event names are "<event>.<service-id>.<OperationName>". Latency includes
+# retries; for event-stream operations (invoke_agent) it is the time to the
+# response headers. Throttles are counted per attempt.
+
+def _aws_labels(event_name):
+    _, service, operation = event_name.split('.', 2)
+    return service, operation
+
+
+def _before_call(context, **kwargs):
+    context['metrics_start'] = time.perf_counter()
+
+
+def _finished(event_name, context, error):
+    start = context.get('metrics_start')
+    if start is not None:
+        labels = _aws_labels(event_name)
+        metrics.observe("aws", labels, time.perf_counter() - start, error=error)
+        retries = context.get('retries', {}).get('attempt', 1) - 1
+        if retries:
+            metrics.count("aws", labels, "retries", retries)
+
+
+def _after_call(event_name, http_response, context, **kwargs):
+    _finished(event_name, context, error=http_response.status_code >= 300)
+
+
+def _after_call_error(event_name, context, **kwargs):
+    # Connection errors, timeouts: no HTTP response at all
+    _finished(event_name, context, error=True)
+
+
+def _response_received(event_name, response_dict=None, parsed_response=None, **kwargs):
+    code = (parsed_response or {}).get('Error', {}).get('Code')
+    status = (response_dict or {}).get('status_code')
+    if code in THROTTLE_CODES or status == 429:
+        metrics.count("aws", _aws_labels(event_name), "throttles")
+
+
+def instrument_botocore(session):
+    """
+    Record every call made by clients of this botocore session.
+    """
+    session.register('before-call', _before_call)
+    session.register('after-call', _after_call)
+    session.register('after-call-error', _after_call_error)
+    session.register('response-received', _response_received)
+
+
+# --- Routes: ASGI middleware -------------------------------------------------
+
+class MetricsMiddleware:
+    """
+    Records latency per method and route template (not the raw path, so
+    path parameters don't create new series). 5xx responses count as errors
+    and 429s as throttles.
+    """
+
+    def __init__(self, app, metrics=metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route is not None else "unmatched")
+            self.metrics.observe("http", labels, time.perf_counter() - start, error=status >= 500)
+            if status == 429:
+                self.metrics.count("http", labels, "throttles")
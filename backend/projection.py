@@ -0,0 +1,46 @@
+from fastapi import HTTPException
+
+MAX_FIELDS = 64
+
+
+def parse_fields(spec):
+    """
+    Parse a fields= projection, comma-separated dotted paths such as
+    "primary_result.GeneratedAnswer.Answer,request_id", into a tree of
+    keys. A key mapped to None is kept whole. Returns None (keep
+    everything) for an empty spec.
+    """
+    if not spec:
+        return None
+    paths = [p.strip() for p in spec.split(",") if p.strip()]
+    if len(paths) > MAX_FIELDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_FIELDS} fields")
+
+    tree = {}
+    for path in paths:
+        keys = path.split(".")
+        if not all(keys):
+            raise HTTPException(status_code=400, detail=f"Invalid field {path!r}")
+        node = tree
+        for key in keys[:-1]:
+            if key in node and node[key] is None:
+                break  # an ancestor is already kept whole
+            node = node.setdefault(key, {})
+        else:
+            node[keys[-1]] = None
+    return tree
+
+
+def project(value, tree):
+    """
+    The parts of value named by tree (from parse_fields). Paths apply to
+    every element of a list along the way, so "source_attributions.url"
+    keeps the url of each attribution; keys a value lacks are left out.
+    """
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: project(value[key], subtree) for key, subtree in tree.items() if key in value}
+    return value
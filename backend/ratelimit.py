@@ -0,0 +1,167 @@
+import os
+import math
+import time
+import asyncio
+
+from botocore.exceptions import ClientError
+from fastapi import HTTPException
+
+from metrics import metrics, THROTTLE_CODES
+
+# Client-side token buckets per AWS operation, sized to the account's TPS quotas so
+# bursts queue here (on the event loop, holding no thread) instead of being throttled
+# by AWS. Comma-separated service.method=rate[/burst]; operations not listed are not limited.
+AWS_RATE_LIMITS = os.getenv(
+    "AWS_RATE_LIMITS",
+    "quicksight.generate_embed_url_for_registered_user=10/20,"
+    "quicksight.generate_embed_url_for_registered_user_with_identity=10/20,"
+    "quicksight.predict_qa_results=10/20",
+)
+# Longest a call may queue for a token; beyond that it fails fast with a 429
+AWS_RATE_LIMIT_MAX_WAIT = float(os.getenv("AWS_RATE_LIMIT_MAX_WAIT", "5"))
+
+
+class RateLimited(ClientError):
+    """
+    Raised, without calling AWS, when an operation's rate limit queue is full.
+    A ClientError so handlers treat it like an AWS throttle.
+    """
+
+    def __init__(self, operation_name, retry_after):
+        super().__init__(
+            {"Error": {"Code": "ClientRateLimited", "Message": f"Rate limit queue full, retry in {retry_after}s"},
+             "ResponseMetadata": {"HTTPStatusCode": 429}},
+            operation_name,
+        )
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Async token bucket: acquire() returns at once while tokens are left and
+    otherwise waits, first come first served, until the next token is due.
+    Refills at rate tokens per second up to burst. A caller that would have
+    to wait longer than max_wait is rejected with RateLimited instead.
+    """
+
+    def __init__(self, rate, burst=None, max_wait=AWS_RATE_LIMIT_MAX_WAIT, name=None):
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.max_wait = max_wait
+        self.name = name
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.queued = 0
+        self._lock = asyncio.Lock()
+
+        self.acquired = 0
+        self.waited = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """
+        Wait for a token and return how long that took.
+        """
+        self._refill()
+        expected_wait = (self.queued + 1 - self.tokens) / self.rate
+        if expected_wait > self.max_wait:
+            self.rejected += 1
+            raise RateLimited(self.name, math.ceil(expected_wait))
+
+        start = time.monotonic()
+        self.queued += 1
+        try:
+            async with self._lock:
+                while True:
+                    self._refill()
+                    if self.tokens >= 1:
+                        break
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens -= 1
+        finally:
+            self.queued -= 1
+
+        waited = time.monotonic() - start
+        self.acquired += 1
+        if waited > 0.001:
+            self.waited += 1
+            self.wait_seconds += waited
+        return waited
+
+    def stats(self):
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "queued": self.queued,
+            "acquired": self.acquired,
+            "waited": self.waited,
+            "rejected": self.rejected,
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
+
+
+class RateLimits:
+    """
+    The token buckets for one set of credentials (one account's quotas),
+    keyed by service and client method name.
+    """
+
+    def __init__(self, spec=AWS_RATE_LIMITS, max_wait=AWS_RATE_LIMIT_MAX_WAIT):
+        self.buckets = {}
+        for entry in filter(None, (e.strip() for e in spec.split(","))):
+            operation, _, limit = entry.partition("=")
+            service, _, method = operation.rpartition(".")
+            rate, _, burst = limit.partition("/")
+            self.buckets[(service, method)] = TokenBucket(
+                float(rate), int(burst) if burst else None, max_wait, name=method
+            )
+
+    async def acquire(self, service, method):
+        """
+        Wait for a token for the operation and return how long that took,
+        or None if it is not limited.
+        """
+        bucket = self.buckets.get((service, method))
+        if bucket is None:
+            return
+        try:
+            waited = await bucket.acquire()
+        except RateLimited:
+            metrics.count("ratelimit", (service, method), "rejected")
+            raise
+        metrics.observe("ratelimit", (service, method), waited)
+        return waited
+
+    def queued(self, service, method):
+        """
+        How many calls are waiting for a token for the operation.
+        """
+        bucket = self.buckets.get((service, method))
+        return bucket.queued if bucket is not None else 0
+
+    def stats(self):
+        return {f"{service}.{method}": bucket.stats() for (service, method), bucket in self.buckets.items()}
+
+
+def raise_if_throttled(e):
+    """
+    Turn a throttled upstream call (by AWS, or rejected by a client-side rate
+    limit) into a 429 with Retry-After, so clients back off instead of
+    seeing a 500.
+    """
+    if not isinstance(e, ClientError):
+        return
+    code = e.response.get("Error", {}).get("Code")
+    if isinstance(e, RateLimited) or code in THROTTLE_CODES:
+        retry_after = getattr(e, "retry_after", 1)
+        raise HTTPException(
+            status_code=429,
+            detail=f"Upstream rate limit ({code}), retry in {retry_after}s",
+            headers={"Retry-After": str(retry_after)},
+        )
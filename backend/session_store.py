@@ -0,0 +1,153 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+# Unset: in-process store (single worker). redis://host:6379/0: shared across workers and hosts.
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL")
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))  # seconds of inactivity before a session is forgotten
+SESSION_STORE_MAX_ENTRIES = int(os.getenv("SESSION_STORE_MAX_ENTRIES", "10000"))
+SESSION_STORE_PREFIX = os.getenv("SESSION_STORE_PREFIX", "quicksuite:session:")
+
+
+class SessionStore(ABC):
+    """
+    Per-user conversation state (Bedrock session IDs, Q Business conversation IDs).
+
+    A record is a small flat dict of string fields. update() merges fields
+    into the record and restarts its TTL; lookups are O(1) in every backend.
+    """
+
+    @abstractmethod
+    async def get(self, key):
+        ...
+
+    @abstractmethod
+    async def update(self, key, **fields):
+        ...
+
+    @abstractmethod
+    async def delete(self, key):
+        ...
+
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process store with LRU eviction and a sliding TTL. Only valid for a single worker.
+    """
+
+    def __init__(self, ttl=SESSION_TTL, max_entries=SESSION_STORE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._records = OrderedDict()  # key -> (expires_at, fields)
+
+    async def get(self, key):
+        entry = self._records.get(key)
+        if entry is None:
+            return None
+        expires_at, fields = entry
+        if expires_at < time.monotonic():
+            del self._records[key]
+            return None
+        return dict(fields)
+
+    async def update(self, key, **fields):
+        entry = self._records.pop(key, None)
+        record = entry[1] if entry and entry[0] >= time.monotonic() else {}
+        record.update({k: str(v) for k, v in fields.items() if v is not None})
+        self._records[key] = (time.monotonic() + self.ttl, record)
+        while len(self._records) > self.max_entries:
+            self._records.popitem(last=False)
+
+    async def delete(self, key):
+        self._records.pop(key, None)
+
+    def __len__(self):
+        return len(self._records)
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Redis-backed store, shared by every worker. Each record is one hash whose
+    expiry is reset on update. Pass client= to use a stand-in such as fakeredis.
+    """
+
+    def __init__(self, url=SESSION_STORE_URL, ttl=SESSION_TTL, prefix=SESSION_STORE_PREFIX, client=None):
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, key):
+        record = await self.client.hgetall(self.prefix + key)
+        return record or None
+
+    async def update(self, key, **fields):
+        mapping = {k: str(v) for k, v in fields.items() if v is not None}
+        async with self.client.pipeline(transaction=True) as pipe:
+            if mapping:
+                pipe.hset(self.prefix + key, mapping=mapping)
+            pipe.expire(self.prefix + key, self.ttl)
+            await pipe.execute()
+
+    async def delete(self, key):
+        await self.client.delete(self.prefix + key)
+
+
+def create_session_store(url=SESSION_STORE_URL):
+    """
+    Build the store configured by SESSION_STORE_URL.
+    """
+    if url:
+        print(f"🗄️ Using Redis session store")
+        return RedisSessionStore(url)
+    return MemorySessionStore()
+
+
+class ConversationHeads:
+    """
+    Server-side Q Business conversation state: for each user, the current
+    conversationId, the latest systemMessageId (the parent of the next turn)
+    and the turn count. Lets a follow-up arrive with just a user ID and a
+    message instead of re-grounding a brand new conversation. Records expire
+    with the store's TTL.
+    """
+
+    def __init__(self, store, prefix="qbusiness:"):
+        self.store = store
+        self.prefix = prefix
+
+    async def resolve(self, user_id, conversation_id=None, parent_message_id=None, new_conversation=False):
+        """
+        Return (conversation_id, parent_message_id, turns) for the next turn.
+        IDs sent by the client win; missing ones are filled from the user's
+        stored head when it is for the same conversation.
+        """
+        if new_conversation:
+            return None, None, 0
+        if not user_id:
+            return conversation_id, parent_message_id, 0
+        head = await self.store.get(self.prefix + user_id) or {}
+        if conversation_id and conversation_id != head.get("conversation_id"):
+            # A conversation the client tracks itself
+            return conversation_id, parent_message_id, 0
+        return (
+            conversation_id or head.get("conversation_id"),
+            parent_message_id or head.get("parent_message_id"),
+            int(head.get("turns", 0)),
+        )
+
+    async def advance(self, user_id, conversation_id, system_message_id, turns):
+        """
+        Record a completed turn; system_message_id becomes the next parent.
+        """
+        if not user_id:
+            return
+        await self.store.update(
+            self.prefix + user_id,
+            conversation_id=conversation_id,
+            parent_message_id=system_message_id,
+            turns=turns + 1,
+        )
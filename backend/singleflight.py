@@ -0,0 +1,52 @@
+import asyncio
+import contextvars
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical upstream calls.
+
+    The first caller for a key starts the call; every caller that arrives
+    while it is still in flight awaits the same task and receives the same
+    result or exception. Nothing is kept once the call completes, so this
+    works with or without a result cache behind it.
+
+    The shared task is shielded: a caller that goes away (e.g. the client
+    disconnects) does not cancel the call for the others. It runs in a fresh
+    context, so it never records into the trace, Server-Timing header or
+    admission latency of the request that happened to start it; callers
+    account for their wait themselves.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        """
+        Await fn() (an async callable), sharing the call with concurrent callers of the same key.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(fn(), context=contextvars.Context())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark the exception retrieved even if every caller went away
+            task.exception()
+
+    def stats(self):
+        return {
+            "in_flight": len(self._inflight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
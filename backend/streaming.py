@@ -0,0 +1,53 @@
+from encoding import dumps
+
+# Disable proxy buffering (nginx) and caching so events reach the client as they are produced
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(data, event=None):
+    """
+    Format one Server-Sent Event frame with a JSON payload.
+    """
+    frame = ""
+    if event:
+        frame += f"event: {event}\n"
+    frame += f"data: {dumps(data).decode()}\n\n"
+    return frame
+
+
+def iter_agent_text(completion):
+    """
+    Yield answer text from a Bedrock invoke_agent completion event stream,
+    one piece per event, as soon as each event arrives.
+    """
+    for event in completion:
+        if "chunk" in event:
+            yield event["chunk"]["bytes"].decode("utf-8")
+        elif "textResponse" in event:
+            yield event["textResponse"]["body"]
+
+
+def chat_sync_events(response):
+    """
+    A Q Business ChatSync response as the (event name, payload) pairs the
+    streaming Chat API would have produced for it: the answer as one
+    textEvent, any plugin action review or auth challenge, then the
+    metadataEvent with the source attributions and message IDs.
+    """
+    ids = {key: response.get(key) for key in ("conversationId", "userMessageId", "systemMessageId")}
+    if response.get("systemMessage"):
+        yield "textEvent", dict(ids, systemMessage=response["systemMessage"])
+    if response.get("actionReview"):
+        yield "actionReviewEvent", dict(ids, **response["actionReview"])
+    if response.get("authChallengeRequest"):
+        yield "authChallengeRequestEvent", response["authChallengeRequest"]
+    for attachment in response.get("failedAttachments") or []:
+        yield "failedAttachmentEvent", dict(ids, attachment=attachment)
+    yield "metadataEvent", dict(
+        ids,
+        sourceAttributions=response.get("sourceAttributions", []),
+        finalTextMessage=response.get("systemMessage"),
+    )
@@ -0,0 +1,258 @@
+import os
+import time
+import asyncio
+from contextvars import ContextVar
+
+from fastapi.responses import JSONResponse
+
+from aws_clients import ClientRegistry, CredentialCache, preload_service_models, run_aws
+from embed_pool import EmbedUrlPool
+from ratelimit import RateLimits
+from admission import AdmissionControl
+from cache import TTLCache
+from singleflight import SingleFlight
+from catalog import Catalog
+from session_store import ConversationHeads
+
+# Tenants served by this process, as name[=ENV_SUFFIX] entries. Each tenant reads
+# its settings from the usual env vars with its suffix appended, e.g.
+# TENANTS=default,ak=_AK serves BEDROCK_AGENT_ID and BEDROCK_AGENT_ID_AK side by side.
+TENANTS = os.getenv("TENANTS", "default")
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT")  # used when a request names no tenant; defaults to the first
+TENANT_HEADER = os.getenv("TENANT_HEADER", "X-Tenant-Id")
+TENANT_PATH_PREFIX = "/t/"  # /t/<tenant>/api/... is routed as /api/... for that tenant
+# Build clients and open connections in the background at startup; /ready reports 503 until done
+AWS_WARMUP = os.getenv("AWS_WARMUP", "true").lower() == "true"
+
+_current_tenant = ContextVar("tenant")
+
+
+def current_tenant():
+    """
+    Tenant of the request being handled.
+    """
+    return _current_tenant.get()
+
+
+class Tenant:
+    """
+    One tenant's configuration plus its own, isolated credentials, client
+    pool, caches and catalogs. Only the interpreter, the botocore service
+    models and the session store are shared between tenants.
+    """
+
+    SERVICES = ['quicksight', 'sts', 'bedrock-agent', 'bedrock-agent-runtime', 'qbusiness']
+
+    def __init__(self, name, env_suffix="", session_store=None):
+        def env(key, default=None):
+            return os.getenv(key + env_suffix, default)
+
+        self.name = name
+        self.agent_id = env("BEDROCK_AGENT_ID")
+        self.agent_alias_id = "CUSTOMER_ANALYTICS_AGENT" + env_suffix
+        self.qs_topic_id = env("QS_TOPIC_ID")
+        self.region = env("AWS_REGION", "us-east-1")
+        self.account_id = env("AWS_ACCOUNT_ID", "803597461034")
+        self.quicksight_namespace = os.getenv("QUICKSIGHT_NAMESPACE", "default")
+        self.profile = env("AWS_PROFILE")  # SSO profile name
+        self.user_arn = env("AWS_USER_ARN")
+        self.q_business_app_id = env("Q_BUSINESS_APP_ID")
+        self.q_business_region = env("Q_BUSINESS_REGION", self.region)  # must match your Q Business app
+        self.user_id = env("USER_ID")
+        self.allowed_domains = [env("IFRAME_DOMAIN") or os.getenv("IFRAME_DOMAIN") or "http://localhost:3000"]
+
+        access_key_id = env("AWS_ACCESS_KEY_ID")
+        secret_access_key = env("AWS_SECRET_ACCESS_KEY")
+        session_token = env("AWS_SESSION_TOKEN")  # For temporary credentials
+        if access_key_id and secret_access_key:
+            print(f"🔐 [{name}] Using AWS Access Key credentials")
+            self.session_kwargs = {
+                'aws_access_key_id': access_key_id,
+                'aws_secret_access_key': secret_access_key,
+            }
+            if session_token:
+                self.session_kwargs['aws_session_token'] = session_token
+                print(f"[{name}] Using temporary credentials with session token")
+        else:
+            print(f"🔐 [{name}] Using AWS Profile: {self.profile}")
+            self.session_kwargs = {'profile_name': self.profile}
+
+        # Isolated per tenant: one tenant's credentials and connections are never used for another.
+        # Clients are built on first use (or during warm-up), never at import.
+        self.credentials = CredentialCache()
+        self.rate_limits = RateLimits()  # per-operation limits sized to this tenant's account quotas
+        self.clients = ClientRegistry(credentials=self.credentials, rate_limits=self.rate_limits)
+        self.admission = AdmissionControl()  # adaptive concurrency limits for the slow routes
+
+        self.quicksight = self.client('quicksight')
+        self.sts = self.client('sts')
+        self.bedrock_agent = self.client('bedrock-agent')  # For list_agents
+        self.bedrock = self.client('bedrock-agent-runtime')  # For invoke_agent
+        self.qbusiness = self.client('qbusiness', region_name=self.q_business_region)
+
+        # Background refills yield to user requests waiting on the embed URL rate limit
+        self.embed_pool = EmbedUrlPool(
+            busy=lambda: self.rate_limits.queued('quicksight', 'generate_embed_url_for_registered_user')
+        )
+        self.qa_cache = TTLCache()
+        self.inflight = SingleFlight()
+        self.topic_catalog = Catalog(f"{name}:topics", self.list_topic_summaries)
+        self.agent_catalog = Catalog(f"{name}:agents", self.list_agent_pages)
+
+        self.session_store = session_store
+        self.conversations = ConversationHeads(session_store, prefix=f"{name}:qbusiness:")
+
+    def client(self, service_name, region_name=None, **kwargs):
+        """
+        Awaitable client for this tenant, built from its own credentials.
+        """
+        return self.clients.async_client(
+            service_name, region_name=region_name or self.region, **self.session_kwargs, **kwargs
+        )
+
+    def session_key(self, key):
+        return f"{self.name}:{key}"
+
+    @property
+    def aws_clients(self):
+        return [self.quicksight, self.sts, self.bedrock_agent, self.bedrock, self.qbusiness]
+
+    async def build_clients(self):
+        """
+        Build every client now. One at a time: they share a boto3 session,
+        which is not thread-safe.
+        """
+        errors = []
+        for client in self.aws_clients:
+            try:
+                await run_aws(lambda: client.sync)
+            except Exception as e:
+                errors.append(f"building client: {e}")
+        return errors
+
+    async def open_connections(self):
+        """
+        Cheap reads that open the TLS connections and preload the catalogs.
+        """
+        results = await asyncio.gather(
+            self.sts.get_caller_identity(),
+            self.topic_catalog.get(),
+            self.agent_catalog.get(),
+            return_exceptions=True,
+        )
+        return [f"opening connections: {r}" for r in results if isinstance(r, Exception)]
+
+    async def list_topic_summaries(self):
+        response = await self.quicksight.list_topics(
+            AwsAccountId=self.account_id
+        )
+        return response.get('TopicsSummaries', [])
+
+    async def list_agent_pages(self, max_results=100):
+        resp = await self.bedrock_agent.list_agents(maxResults=max_results)
+        agents = resp.get('agentSummaries', [])
+        next_token = resp.get('nextToken')
+
+        while next_token:
+            resp = await self.bedrock_agent.list_agents(maxResults=max_results, nextToken=next_token)
+            agents.extend(resp.get('agentSummaries', []))
+            next_token = resp.get('nextToken')
+
+        return agents
+
+
+class TenantRegistry:
+    def __init__(self, tenants, default=None):
+        self.tenants = {tenant.name: tenant for tenant in tenants}
+        self.default = self.tenants[default] if default else tenants[0]
+        self.ready = False
+        self.warmup_seconds = None
+        self.warmup_errors = {}
+        self._warmup_task = None
+
+    @classmethod
+    def from_env(cls, session_store, spec=TENANTS, default=DEFAULT_TENANT):
+        tenants = []
+        for entry in spec.split(","):
+            name, _, suffix = entry.strip().partition("=")
+            tenants.append(Tenant(name, suffix, session_store))
+        return cls(tenants, default)
+
+    def get(self, name=None):
+        return self.tenants.get(name) if name else self.default
+
+    def start_warm_up(self):
+        """
+        Called at startup: warm up in the background (if AWS_WARMUP) while the
+        server already accepts connections, and flip ready when done.
+        """
+        if AWS_WARMUP:
+            self._warmup_task = asyncio.create_task(self.warm_up())
+        else:
+            self.ready = True
+
+    async def warm_up(self):
+        """
+        Parse the service models once and build every tenant's clients (CPU
+        bound, so sequentially), then open all tenants' connections
+        concurrently. Errors (e.g. credentials not available yet) are
+        reported, not raised: the affected calls are retried lazily on the
+        first request.
+        """
+        start = time.perf_counter()
+        await preload_service_models(Tenant.SERVICES)
+        errors = {tenant.name: await tenant.build_clients() for tenant in self}
+        opened = await asyncio.gather(*(tenant.open_connections() for tenant in self))
+        for tenant, tenant_errors in zip(self, opened):
+            errors[tenant.name] += tenant_errors
+        self.warmup_errors = {name: errors for name, errors in errors.items() if errors}
+        self.warmup_seconds = round(time.perf_counter() - start, 3)
+        self.ready = True
+        print(f"✅ Warm-up finished in {self.warmup_seconds}s")
+        for name, tenant_errors in self.warmup_errors.items():
+            print(f"⚠️ [{name}] warm-up: {'; '.join(tenant_errors)}")
+
+    def __iter__(self):
+        return iter(self.tenants.values())
+
+
+class TenantMiddleware:
+    """
+    Selects the tenant for each request from a /t/<tenant>/ path prefix
+    (stripped before routing) or the tenant header, falling back to the
+    default tenant. Unknown tenants get a 404.
+    """
+
+    def __init__(self, app, tenants):
+        self.app = app
+        self.tenants = tenants
+        self.header = TENANT_HEADER.lower().encode("latin-1")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+
+        name = None
+        path = scope["path"]
+        if path.startswith(TENANT_PATH_PREFIX):
+            name, _, rest = path[len(TENANT_PATH_PREFIX):].partition("/")
+            scope = dict(scope, path="/" + rest, raw_path=("/" + rest).encode("utf-8"))
+        else:
+            for key, value in scope["headers"]:
+                if key == self.header:
+                    name = value.decode("latin-1")
+                    break
+
+        tenant = self.tenants.get(name)
+        if tenant is None:
+            if scope["type"] == "websocket":
+                await send({"type": "websocket.close", "code": 4404})
+                return
+            response = JSONResponse({"detail": f"Unknown tenant: {name}"}, status_code=404)
+            return await response(scope, receive, send)
+
+        token = _current_tenant.set(tenant)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_tenant.reset(token)
@@ -0,0 +1,77 @@
+import os
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from starlette.datastructures import MutableHeaders
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() == "true"
+
+# Phases of the request being handled, collected by record
+_phases = ContextVar("server_timing", default=None)
+
+
+def record(name, seconds, description=None):
+    """
+    Add a phase to the current request's Server-Timing header (a no-op
+    outside a request, e.g. in background refreshes). Safe to call from
+    executor threads running with the request's context.
+    """
+    phases = _phases.get()
+    if phases is not None:
+        phases.append((name, seconds, description))  # a shared list, so copies of the context add to it too
+
+
+@contextmanager
+def phase(name, description=None):
+    """
+    Record the body of the block as a phase of the current request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start, description)
+
+
+def _metric(name, seconds, description=None):
+    metric = f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)};dur={seconds * 1000:.1f}"
+    if description:
+        metric += ';desc="' + re.sub(r'[",;\\]', "", description) + '"'
+    return metric
+
+
+class ServerTimingMiddleware:
+    """
+    Adds a Server-Timing header to every response: the phases recorded while
+    handling it (admission queue, rate limit waits, credential resolution,
+    each AWS call, serialization), then the total up to the response
+    headers. Phases may overlap; credential resolution happens inside the
+    AWS call that needed it. For streamed responses only what happened
+    before the first byte is included.
+    """
+
+    def __init__(self, app, enabled=SERVER_TIMING):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.enabled:
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        phases = []
+        token = _phases.set(phases)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                metrics = [_metric(*phase) for phase in phases]
+                metrics.append(_metric("total", time.perf_counter() - start))
+                MutableHeaders(raw=message["headers"]).append("Server-Timing", ", ".join(metrics))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _phases.reset(token)
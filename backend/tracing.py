@@ -0,0 +1,409 @@
+import os
+import json
+import time
+import queue
+import random
+import threading
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from starlette.datastructures import Headers, MutableHeaders
+
+# Unset: tracing off. file: OTLP/JSON batches appended to TRACING_FILE, one per line.
+# otlp: POSTed as OTLP/HTTP JSON to TRACING_OTLP_ENDPOINT (a collector, or benchmarks/otlp_collector.py).
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "")
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+# Fraction of requests traced (unless the caller's traceparent decided already); the rest cost next to nothing
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "0.1"))
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "backend")
+TRACING_EXPORT_INTERVAL = float(os.getenv("TRACING_EXPORT_INTERVAL", "2"))  # seconds between batches
+TRACING_MAX_QUEUE = int(os.getenv("TRACING_MAX_QUEUE", "4096"))  # spans waiting for export; more are dropped
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+
+# Span of the request being handled (None when it is not sampled)
+_current = ContextVar("trace_span", default=None)
+
+
+class Span:
+    """
+    One timed operation of a trace, with OTLP-style attributes. Ended spans
+    go to the tracer's exporter.
+    """
+
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "kind", "attributes",
+                 "start_ns", "end_ns", "error")
+
+    def __init__(self, tracer, name, trace_id, parent_id=None, kind=INTERNAL, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = random.getrandbits(64) or 1
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def add(self, key, n=1):
+        self.attributes[key] = self.attributes.get(key, 0) + n
+
+    def set_error(self, message):
+        self.error = str(message)
+
+    def end(self):
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+            self.tracer.exporter.export(self)
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id:032x}-{self.span_id:016x}-01"
+
+    def to_otlp(self):
+        span = {
+            "traceId": f"{self.trace_id:032x}",
+            "spanId": f"{self.span_id:016x}",
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "status": {"code": 2, "message": self.error} if self.error is not None else {"code": 1},
+        }
+        if self.parent_id is not None:
+            span["parentSpanId"] = f"{self.parent_id:016x}"
+        return span
+
+
+def _otlp_attributes(attributes):
+    def value(v):
+        if isinstance(v, bool):
+            return {"boolValue": v}
+        if isinstance(v, int):
+            return {"intValue": str(v)}
+        if isinstance(v, float):
+            return {"doubleValue": v}
+        return {"stringValue": str(v)}
+
+    return [{"key": key, "value": value(v)} for key, v in attributes.items()]
+
+
+def parse_traceparent(header):
+    """
+    (trace id, parent span id, sampled) from a W3C traceparent header, or None.
+    """
+    parts = (header or "").strip().split("-")
+    if len(parts) != 4 or parts[0] == "ff" or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        trace_id, parent_id, flags = int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    if not trace_id or not parent_id:
+        return None
+    return trace_id, parent_id, bool(flags & 1)
+
+
+class SpanExporter:
+    """
+    Batches ended spans and hands each batch, as an OTLP/JSON export request,
+    to write on a background thread, so request handling never waits on
+    export. When the queue is full, spans are dropped and counted.
+    """
+
+    def __init__(self, write, interval=TRACING_EXPORT_INTERVAL, max_queue=TRACING_MAX_QUEUE,
+                 service_name=TRACING_SERVICE_NAME):
+        self.write = write
+        self.interval = interval
+        self.service_name = service_name
+        self.exported = 0
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        spans = []
+        while True:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not spans:
+            return
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": self.service_name})},
+            "scopeSpans": [{"scope": {"name": "backend.tracing"}, "spans": [span.to_otlp() for span in spans]}],
+        }]}
+        try:
+            self.write(json.dumps(payload).encode("utf-8"))
+            self.exported += len(spans)
+        except Exception as e:
+            self.dropped += len(spans)
+            print(f"Error exporting {len(spans)} spans: {e}")
+
+    def shutdown(self):
+        self._stop.set()
+        self.flush()
+
+    def stats(self):
+        return {"queued": self._queue.qsize(), "exported": self.exported, "dropped": self.dropped}
+
+
+def file_writer(path):
+    lock = threading.Lock()
+
+    def write(body):
+        with lock, open(path, "ab") as f:
+            f.write(body + b"\n")
+
+    return write
+
+
+def otlp_writer(endpoint, timeout=5):
+    def write(body):
+        request = urllib.request.Request(endpoint, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+
+    return write
+
+
+class Tracer:
+    """
+    Head-sampled tracing: a request is traced or not as a whole, decided
+    from the trace id (so every service sampling at the same rate keeps
+    the same traces) unless the caller's traceparent already decided.
+    Untraced requests create no spans at all.
+    """
+
+    def __init__(self, exporter=None, sample_rate=TRACING_SAMPLE_RATE):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    @classmethod
+    def from_env(cls):
+        if TRACING_EXPORTER == "file":
+            return cls(SpanExporter(file_writer(TRACING_FILE)))
+        if TRACING_EXPORTER == "otlp":
+            return cls(SpanExporter(otlp_writer(TRACING_OTLP_ENDPOINT)))
+        return cls()
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def start_root(self, name, traceparent=None, kind=SERVER, attributes=None):
+        """
+        Root span of a request (a child of the caller's span, given its
+        traceparent), or None if the request is not sampled.
+        """
+        if not self.enabled:
+            return None
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = random.getrandbits(128) or 1, None
+            sampled = (trace_id & 0xFFFFFFFFFFFFFFFF) < self.sample_rate * 2 ** 64
+        if not sampled:
+            return None
+        return Span(self, name, trace_id, parent_id, kind, attributes)
+
+    def shutdown(self):
+        if self.exporter is not None:
+            self.exporter.shutdown()
+
+
+tracer = Tracer.from_env()
+
+
+def current_span():
+    return _current.get()
+
+
+def start_span(name, kind=INTERNAL, attributes=None):
+    """
+    Child of the current span, not made current (for spans that outlive
+    the code starting them, such as a stream read across many awaits), or
+    None if the request is not traced. End it with end().
+    """
+    parent = _current.get()
+    if parent is None:
+        return None
+    return Span(parent.tracer, name, parent.trace_id, parent.span_id, kind, attributes)
+
+
+@contextmanager
+def span(name, kind=INTERNAL, attributes=None):
+    """
+    Child of the current span for the body of the block, current within it.
+    Yields None if the request is not traced.
+    """
+    child = start_span(name, kind, attributes)
+    if child is None:
+        yield None
+        return
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.set_error(repr(e))
+        raise
+    finally:
+        _current.reset(token)
+        child.end()
+
+
+@contextmanager
+def root_span(name, traceparent=None, kind=SERVER, attributes=None):
+    """
+    Root span of a request for the body of the block (see Tracer.start_root).
+    """
+    root = tracer.start_root(name, traceparent, kind, attributes)
+    if root is None:
+        yield None
+        return
+    token = _current.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        root.set_error(repr(e))
+        raise
+    finally:
+        _current.reset(token)
+        root.end()
+
+
+# --- AWS calls: botocore event hooks -----------------------------------------
+# Calls run on the AWS executor in a copy of the request's context (see
+# run_aws), so the current span there is the one AsyncClient opened for the
+# call. These hooks add what only botocore knows; calls made outside
+# AsyncClient get a span of their own.
+
+def _before_call(event_name, model, params, context, **kwargs):
+    current = _current.get()
+    if current is None:
+        return
+    if current.kind == CLIENT and "rpc.method" not in current.attributes:
+        own, call_span = False, current
+    else:
+        own, call_span = True, Span(current.tracer, model.name, current.trace_id, current.span_id, CLIENT)
+    service = model.service_model.service_id
+    call_span.name = f"{service}/{model.name}"
+    call_span.attributes.update({"rpc.system": "aws-api", "rpc.service": str(service), "rpc.method": model.name})
+    context["trace_span"] = (call_span, own)
+
+
+def _request_created(request, **kwargs):
+    # Per attempt; the body is the same on every one
+    call_span, _ = request.context.get("trace_span", (None, False))
+    if call_span is not None:
+        call_span.set_attribute("http.request.body.size", len(request.body or b""))
+
+
+def _finished(context, http_response=None, parsed=None, exception=None):
+    call_span, own = context.get("trace_span", (None, False))
+    if call_span is None:
+        return
+    call_span.set_attribute("aws.retries", context.get("retries", {}).get("attempt", 1) - 1)
+    if http_response is not None:
+        call_span.set_attribute("http.response.status_code", http_response.status_code)
+        length = http_response.headers.get("content-length")
+        if length is not None:
+            call_span.set_attribute("http.response.body.size", int(length))
+    metadata = (parsed or {}).get("ResponseMetadata", {})
+    if metadata.get("RequestId"):
+        call_span.set_attribute("aws.request_id", metadata["RequestId"])
+    error = (parsed or {}).get("Error", {}).get("Code") or (repr(exception) if exception is not None else None)
+    if error:
+        call_span.set_error(error)
+    if own:
+        call_span.end()
+
+
+def _after_call(http_response, parsed, context, **kwargs):
+    _finished(context, http_response, parsed)
+
+
+def _after_call_error(context, exception=None, **kwargs):
+    _finished(context, exception=exception)
+
+
+def instrument_botocore(session):
+    """
+    Annotate every call made by clients of this botocore session with a span.
+    """
+    session.register('before-call', _before_call)
+    session.register('request-created', _request_created)
+    session.register('after-call', _after_call)
+    session.register('after-call-error', _after_call_error)
+
+
+# --- Routes: ASGI middleware -------------------------------------------------
+
+class TracingMiddleware:
+    """
+    Traces sampled requests: a server span per request, named after the
+    route template, that ends once the response body is sent (so streamed
+    responses cover the whole stream). Continues the caller's trace when
+    it sends a traceparent, and returns the request's span in a
+    traceresponse header.
+    """
+
+    def __init__(self, app, current_tenant=None):
+        self.app = app
+        self.current_tenant = current_tenant
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracer.enabled:
+            return await self.app(scope, receive, send)
+
+        attributes = {"http.request.method": scope["method"], "url.path": scope["path"]}
+        if self.current_tenant is not None:
+            attributes["tenant"] = self.current_tenant().name
+        with root_span(scope["method"], Headers(scope=scope).get("traceparent"), attributes=attributes) as root:
+            if root is None:
+                return await self.app(scope, receive, send)
+
+            async def send_traced(message):
+                if message["type"] == "http.response.start":
+                    root.set_attribute("http.response.status_code", message["status"])
+                    if message["status"] >= 500:
+                        root.set_error(f"HTTP {message['status']}")
+                    MutableHeaders(raw=message["headers"]).append("traceresponse", root.traceparent)
+                elif message["type"] == "http.response.body":
+                    root.add("http.response.body.size", len(message.get("body", b"")))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_traced)
+            finally:
+                route = scope.get("route")
+                if route is not None:
+                    root.name = f"{scope['method']} {route.path}"
+                    root.set_attribute("http.route", route.path)
@@ -1,6 +1,11 @@
 import streamlit as st
 import requests
 import os
+import json
+import time
+import uuid
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -8,6 +13,8 @@ load_dotenv()
 
 # Configuration
 API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8004")
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", "60"))  # seconds to connect, and between bytes of a response
+CHAT_STREAM_PATH = os.getenv("CHAT_STREAM_PATH", "/chatsync/stream")  # streamed answers, if the backend has them
 
 # Page configuration
 st.set_page_config(
@@ -54,9 +61,111 @@ if "show_quicksight" not in st.session_state:
     st.session_state.show_quicksight = False
 if "api_logs" not in st.session_state:
     st.session_state.api_logs = []
+if "embed_url" not in st.session_state:
+    st.session_state.embed_url = None  # the mounted QuickSight view's URL, kept across reruns
+if "chat_user_id" not in st.session_state:
+    st.session_state.chat_user_id = str(uuid.uuid4())  # this browser session's Q Business conversation
+if "new_conversation" not in st.session_state:
+    st.session_state.new_conversation = False  # start over on the next turn, after a clear
+if "chat_streams" not in st.session_state:
+    st.session_state.chat_streams = True  # until the backend says it cannot stream
 
-def log_api_call(method, url, status_code, response_time=None, response_data=None):
-    """Log API calls for debugging"""
+@st.cache_resource
+def http_session():
+    """
+    One pooled keep-alive HTTP session for every rerun and every user, so
+    calls reuse open connections to the backend instead of connecting anew.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)  # users are served on separate threads
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Shared by every user of the app, so it must keep no cookies
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+def sse_events(response):
+    """(event, data) for each Server-Sent Event of a streamed response, as it arrives"""
+    event, data = "message", []
+    for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+        elif not line and data:
+            yield event, json.loads("\n".join(data))
+            event, data = "message", []
+
+def message_html(message):
+    if message["sender"] == "user":
+        return f"""
+            <div class="chat-message user-message">
+                <strong>You:</strong><br>{message["text"]}
+            </div>
+        """
+    return f"""
+        <div class="chat-message bot-message">
+            <strong>Bot:</strong><br>{message["text"]}
+        </div>
+    """
+
+def chat_payload(message):
+    """Chat request body: this session's conversation, restarted after a clear"""
+    return {
+        "user_id": st.session_state.chat_user_id,
+        "message": message,
+        "new_conversation": st.session_state.new_conversation,
+    }
+
+def stream_chat(message, placeholder):
+    """
+    Ask the backend's streaming chat route, rendering the answer into
+    placeholder as it arrives. Returns the reply, or None if the backend
+    does not stream.
+    """
+    if not st.session_state.chat_streams:
+        return None
+    start_time = time.time()
+    url = f"{API_BASE_URL}{CHAT_STREAM_PATH}"
+    with http_session().post(url, json=chat_payload(message),
+                             stream=True, timeout=API_TIMEOUT) as response:
+        if response.status_code in (404, 405, 501):
+            # No such route, or the backend's AWS SDK cannot stream Q Business answers
+            st.session_state.chat_streams = False
+            return None
+        if response.status_code != 200:
+            response_time = round((time.time() - start_time) * 1000, 2)
+            log_api_call("POST", url, response.status_code, f"{response_time}ms", {"error": response.text}, response.headers.get("Server-Timing"))
+            return f"Error: Failed to get response (Status: {response.status_code})"
+
+        text, final = "", {}
+        for event, data in sse_events(response):
+            if event == "chunk":
+                text += data["text"]
+                placeholder.markdown(message_html({"sender": "bot", "text": text + " ▌"}), unsafe_allow_html=True)
+            elif event == "done":
+                final = data
+            elif event == "error":
+                text += f"\n\nError: {data.get('detail')}"
+        response_time = round((time.time() - start_time) * 1000, 2)
+        log_api_call("POST", url, response.status_code, f"{response_time}ms", {"systemMessage": text, **final}, response.headers.get("Server-Timing"))
+    return text or "No response from bot"
+
+def parse_server_timing(header):
+    """Phases of a Server-Timing header, as [{"name", "dur" (ms), "desc"}]"""
+    phases = []
+    for metric in filter(None, (m.strip() for m in (header or "").split(","))):
+        name, *params = (p.strip() for p in metric.split(";"))
+        values = dict(p.split("=", 1) for p in params if "=" in p)
+        try:
+            dur = float(values.get("dur", 0))
+        except ValueError:
+            dur = 0.0
+        phases.append({"name": name, "dur": dur, "desc": values.get("desc", "").strip('"')})
+    return phases
+
+def log_api_call(method, url, status_code, response_time=None, response_data=None, server_timing=None):
+    """Log API calls for debugging, with the backend's Server-Timing breakdown"""
     import datetime
     log_entry = {
         "timestamp": datetime.datetime.now().strftime("%H:%M:%S"),
@@ -64,7 +173,8 @@ def log_api_call(method, url, status_code, response_time=None, response_data=Non
         "url": url,
         "status": status_code,
         "response_time": response_time,
-        "response": response_data
+        "response": response_data,
+        "timing": parse_server_timing(server_timing)
     }
     st.session_state.api_logs.append(log_entry)
     # Keep only last 10 logs
@@ -78,41 +188,52 @@ with col1:
 with col2:
     if st.button("🔄 Toggle View", key="toggle_view_btn", use_container_width=True):
         st.session_state.show_quicksight = not st.session_state.show_quicksight
+        # Embed URLs are single-use: the iframe being unmounted has redeemed this one,
+        # so reopening the view needs a fresh URL
+        st.session_state.embed_url = None
         st.rerun()
 
 # Show current view
 if st.session_state.show_quicksight:
     st.subheader("📊 QuickSight Embed")
     
-    # Fetch embed URL
-    try:
-        with st.spinner("Loading QuickSight Chat..."):
-            import time
-            start_time = time.time()
-            url = f"{API_BASE_URL}/get-embed-url/"
-            response = requests.get(url)
-            response_time = round((time.time() - start_time) * 1000, 2)
-            
-            if response.status_code == 200:
-                data = response.json()
-                log_api_call("GET", url, response.status_code, f"{response_time}ms", data)
-            else:
-                log_api_call("GET", url, response.status_code, f"{response_time}ms", {"error": response.text})
-            
-            if response.status_code == 200:
-                embed_url = data.get("embedUrl")
+    # Fetch an embed URL only when there is none. While the view stays open the
+    # URL is kept however old: the iframe has redeemed it, and changing it would
+    # reload the dashboard and lose the QuickSight session.
+    if st.session_state.embed_url is None:
+        try:
+            with st.spinner("Loading QuickSight Chat..."):
+                start_time = time.time()
+                url = f"{API_BASE_URL}/get-embed-url/"
+                response = http_session().get(url, timeout=API_TIMEOUT)
+                response_time = round((time.time() - start_time) * 1000, 2)
                 
-                if embed_url:
-                    # Display iframe with QuickSight embed
-                    st.components.v1.iframe(embed_url, height=700, scrolling=True)
+                if response.status_code == 200:
+                    data = response.json()
+                    log_api_call("GET", url, response.status_code, f"{response_time}ms", data, response.headers.get("Server-Timing"))
                 else:
-                    st.error("No embed URL received from backend")
-            else:
-                st.error(f"Failed to fetch embed URL: {response.status_code}")
+                    log_api_call("GET", url, response.status_code, f"{response_time}ms", {"error": response.text}, response.headers.get("Server-Timing"))
                 
-    except Exception as e:
-        st.error(f"Error fetching embed URL: {str(e)}")
-        st.info("Make sure your backend is running at " + API_BASE_URL)
+                if response.status_code == 200:
+                    embed_url = data.get("embedUrl")
+                    
+                    if embed_url:
+                        st.session_state.embed_url = embed_url
+                    else:
+                        st.error("No embed URL received from backend")
+                else:
+                    st.error(f"Failed to fetch embed URL: {response.status_code}")
+                    
+        except Exception as e:
+            st.error(f"Error fetching embed URL: {str(e)}")
+            st.info("Make sure your backend is running at " + API_BASE_URL)
+
+    if st.session_state.embed_url:
+        # Display iframe with QuickSight embed
+        st.components.v1.iframe(st.session_state.embed_url, height=700, scrolling=True)
+        if st.button("🔁 New QuickSight Session", key="new_embed_url_btn"):
+            st.session_state.embed_url = None
+            st.rerun()
 
 else:
     st.subheader("💬 Chat Interface")
@@ -121,18 +242,7 @@ else:
     chat_container = st.container()
     with chat_container:
         for message in st.session_state.messages:
-            if message["sender"] == "user":
-                st.markdown(f"""
-                    <div class="chat-message user-message">
-                        <strong>You:</strong><br>{message["text"]}
-                    </div>
-                """, unsafe_allow_html=True)
-            else:
-                st.markdown(f"""
-                    <div class="chat-message bot-message">
-                        <strong>Bot:</strong><br>{message["text"]}
-                    </div>
-                """, unsafe_allow_html=True)
+            st.markdown(message_html(message), unsafe_allow_html=True)
     
     # Chat input
     with st.form(key="chat_form", clear_on_submit=True):
@@ -153,41 +263,41 @@ else:
             "sender": "user",
             "text": user_input
         })
+        # Show it now, with the answer rendered below it as it streams in
+        with chat_container:
+            st.markdown(message_html(st.session_state.messages[-1]), unsafe_allow_html=True)
+            reply_placeholder = st.empty()
         
         # Send to backend
         try:
-            with st.spinner("Thinking..."):
-                import time
-                start_time = time.time()
-                url = f"{API_BASE_URL}/chat"
-                response = requests.post(
-                    url,
-                    json={
-                        "user_id": "localUser1",
-                        "message": user_input
-                    }
-                )
-                response_time = round((time.time() - start_time) * 1000, 2)
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    log_api_call("POST", url, response.status_code, f"{response_time}ms", data)
-                else:
-                    log_api_call("POST", url, response.status_code, f"{response_time}ms", {"error": response.text})
-                
-                if response.status_code == 200:
-                    bot_reply = data.get("reply", "No response from bot")
+            bot_reply = stream_chat(user_input, reply_placeholder)
+            if bot_reply is None:
+                # The backend does not stream: wait for the whole answer
+                with st.spinner("Thinking..."):
+                    start_time = time.time()
+                    url = f"{API_BASE_URL}/chat"
+                    response = http_session().post(
+                        url,
+                        json=chat_payload(user_input),
+                        timeout=API_TIMEOUT
+                    )
+                    response_time = round((time.time() - start_time) * 1000, 2)
                     
-                    # Add bot message
-                    st.session_state.messages.append({
-                        "sender": "bot",
-                        "text": bot_reply
-                    })
-                else:
-                    st.session_state.messages.append({
-                        "sender": "bot",
-                        "text": f"Error: Failed to get response (Status: {response.status_code})"
-                    })
+                    if response.status_code == 200:
+                        data = response.json()
+                        log_api_call("POST", url, response.status_code, f"{response_time}ms", data, response.headers.get("Server-Timing"))
+                        bot_reply = data.get("reply", "No response from bot")
+                    else:
+                        log_api_call("POST", url, response.status_code, f"{response_time}ms", {"error": response.text}, response.headers.get("Server-Timing"))
+                        bot_reply = f"Error: Failed to get response (Status: {response.status_code})"
+            if not bot_reply.startswith("Error:"):
+                st.session_state.new_conversation = False
+            
+            # Add bot message
+            st.session_state.messages.append({
+                "sender": "bot",
+                "text": bot_reply
+            })
                     
         except Exception as e:
             st.session_state.messages.append({
@@ -207,6 +317,7 @@ with st.sidebar:
     
     if st.button("Clear Chat History", key="clear_chat_btn", use_container_width=True):
         st.session_state.messages = []
+        st.session_state.new_conversation = True
         st.rerun()
     
     st.markdown("---")
@@ -220,6 +331,14 @@ with st.sidebar:
             st.caption(f"{log['url']}")
             st.caption(f"Status: {log['status']} | Time: {log['response_time']}")
             
+            # Where the backend spent its time (the rest of Time is network and streaming)
+            if log.get("timing"):
+                longest = max(phase["dur"] for phase in log["timing"]) or 1
+                st.text("\n".join(
+                    f"{phase['name'][:18]:<18} {'█' * round(phase['dur'] / longest * 10):<10} {phase['dur']:>8.1f} ms"
+                    for phase in log["timing"]
+                ))
+            
             # Show response data in expander
             if log.get("response"):
                 with st.expander("View Response"):